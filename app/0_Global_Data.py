@@ -96,11 +96,9 @@ if st.session_state.authentication_status:
     nama_survei = st.sidebar.selectbox('Nama Survei', list_survei, index=idx)
     url_params.update({'nama_survei': nama_survei})
 
-    # Remove 'dm' state if nama_survei changes
+    # Reset states if nama_survei changes
     if 'nama_survei' in st.session_state:
         if nama_survei != st.session_state.nama_survei:
-            dm = generate_datamart(nama_survei)
-            st.session_state.dm = dm
             st.session_state.nama_survei = nama_survei
             target_column = target_columns[nama_survei]
             if target_column is None:
@@ -109,18 +107,16 @@ if st.session_state.authentication_status:
     # ----------------------------------------------------------------------------------------------------------------------------
     # Data Mart
 
-    if 'dm' not in st.session_state:
-        dm = generate_datamart(nama_survei)
-        st.session_state.dm = dm
-    else:
-        dm = st.session_state.dm
+    # shared datamart of the published version (reloaded once per process when the survey is republished)
+    dm = generate_datamart(nama_survei)
+    st.session_state.dm = dm
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Target Categories
 
     target_column = target_columns[nama_survei]
     if target_column is not None:
-        target_categories = dm.df[target_column].unique().tolist()
+        target_categories = dm.cube[target_column].unique().tolist()
         target_categories.sort()
         if param_category is not None:
             selected_category = st.sidebar.selectbox('Target Category', target_categories, index=target_categories.index(param_category))
@@ -150,7 +146,7 @@ if st.session_state.authentication_status:
     # ----------------------------------------------------------------------------------------------------------------------------
     # Build Global Datamart
     
-    dm.get_total_number(None, None, target_column, selected_category)
+    dm.get_total_number(None, target_column, selected_category)
     dm.get_list_location()
     dm.get_agg_status(None, target_column, selected_category)
     dm.get_number_location(target_column, selected_category)
@@ -213,8 +209,7 @@ if st.session_state.authentication_status:
             )
             pie2.plotly_chart(fig, use_container_width=True)
 
-        data = dm.df
-        target_barchart(dm.get_agg_target(data, target_column))
+        target_barchart(dm.get_agg_target(None, target_column))
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Metrics: number of locations
@@ -272,13 +267,6 @@ if st.session_state.authentication_status:
             title = 'Survey Data (Kelurahan Level):'
             data_survey = dm.df_rekap_all[dm.df_rekap_all[region].isin(list_data_target)][usecols1+usecols2].sort_values(region)
         st.markdown(title)
-        data_survey['Kelurahan'] = data_survey.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kab_kota={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&selected_kelurahan={x.Kelurahan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kelurahan}</a>', axis=1)
-        if region == 'Provinsi':
-            data_survey['Provinsi'] = data_survey.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Provinsi}</a>', axis=1)            
-        if region == 'Kabupaten_Kota':
-            data_survey['Kabupaten_Kota'] = data_survey.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kab_kota={x.Kabupaten_Kota}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kabupaten_Kota}</a>', axis=1)            
-        if region == 'Kecamatan':
-            data_survey['Kecamatan'] = data_survey.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kab_kota={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kecamatan}</a>', axis=1)            
         height = get_table_height(data_survey)
         gb = GridOptionsBuilder.from_dataframe(data_survey)
         cols = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan']
@@ -286,6 +274,7 @@ if st.session_state.authentication_status:
             gb.configure_column(reg, cellRenderer=renderer)
         gb.configure_columns(cols, pinned='left')
         gridOptions = gb.build()
+        gridOptions['context'] = get_grid_context(nama_survei, selected_category)
         gridOptions['getRowStyle'] = jscode3
         AgGrid(data_survey, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=True, allow_unsafe_jscode=True, height=height, update_mode=GridUpdateMode.VALUE_CHANGED)
 
@@ -415,10 +404,10 @@ if st.session_state.authentication_status:
             filter_selection = dm.df_rekap_prov['Provinsi'] == selected_provinsi_map
         data = dm.df_rekap_prov[filter_selection]
         data = data.drop(['Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent'], axis=1)
-        data['Provinsi'] = get_link('Provinsi', data, nama_survei, selected_category)
         gb = GridOptionsBuilder.from_dataframe(data)
         gb.configure_column('Provinsi', cellRenderer=cell_renderer_prov)
         gridOptions = gb.build()
+        gridOptions['context'] = get_grid_context(nama_survei, selected_category)
         gridOptions['getRowStyle'] = jscode2
         AgGrid(data, gridOptions=gridOptions, fit_columns_on_grid_load=False, allow_unsafe_jscode=True, height=65, update_mode=GridUpdateMode.VALUE_CHANGED)
             
@@ -437,7 +426,6 @@ if st.session_state.authentication_status:
         data = dm.df_rekap_prov[filter_].sort_values('Provinsi')
         dropcols = ['Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
         data_download = data.drop(dropcols, axis=1)
-        data['Provinsi'] = get_link('Provinsi', data, nama_survei, selected_category)
         if target_column is not None:
             dropcols += [target_column]
         data = data.drop(dropcols, axis=1)
@@ -448,6 +436,7 @@ if st.session_state.authentication_status:
         gb.configure_default_column(min_column_width=200)
         gb.configure_column('Provinsi', cellRenderer=cell_renderer_prov, pinned='left')
         gridOptions = gb.build()
+        gridOptions['context'] = get_grid_context(nama_survei, selected_category)
         gridOptions['getRowStyle'] = jscode2
         AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=False, allow_unsafe_jscode=True, height=height, enableSorting=True, enableFilter=True, update_mode=GridUpdateMode.VALUE_CHANGED)             
 
@@ -494,24 +483,27 @@ if st.session_state.authentication_status:
     st.markdown("---")
 
     with st.expander('Raw Table (Unfiltered)'):
-        data = dm.df
-        height = get_table_height(data)
-        gb = GridOptionsBuilder.from_dataframe(data)
-        gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
-        gridOptions = gb.build()
-        gridOptions['getRowStyle'] = jscode1
+        # wide submissions are only loaded when asked for
+        if st.checkbox('Load Table', key='raw_table_global'):
+            data = dm.df
+            height = get_table_height(data)
+            gb = GridOptionsBuilder.from_dataframe(data)
+            gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
+            gridOptions = gb.build()
+            gridOptions['context'] = get_grid_context(nama_survei, selected_category)
+            gridOptions['getRowStyle'] = jscode1
 
-        AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=False,
-                allow_unsafe_jscode=True, height=height, 
-                update_mode=GridUpdateMode.VALUE_CHANGED)
+            AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=False,
+                    allow_unsafe_jscode=True, height=height, 
+                    update_mode=GridUpdateMode.VALUE_CHANGED)
         
-        # Create a download button
-        st.download_button(
-            "Download Table",
-            data=download_dataframe_as_excel(data.drop(['Link'], axis=1)),
-            file_name="raw_data.xlsx",
-            mime="application/vnd.ms-excel",
-        )
+            # Create a download button
+            st.download_button(
+                "Download Table",
+                data=download_dataframe_as_excel(data),
+                file_name="raw_data.xlsx",
+                mime="application/vnd.ms-excel",
+            )
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Data Anomalies
@@ -522,27 +514,32 @@ if st.session_state.authentication_status:
 
         # Duplicates By Repondents
         with tab1:
-            data = dm.df[dm.df[['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'NAMA_KK', 'NAMA_RESPONDEN']].duplicated(keep=False)].sort_values('NAMA_RESPONDEN')
-            height = get_table_height(data)
-            gb = GridOptionsBuilder.from_dataframe(data)
-            gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
-            gridOptions = gb.build()
-            gridOptions['getRowStyle'] = jscode1
-            AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=False,
-                    allow_unsafe_jscode=True, height=height, 
-                    update_mode=GridUpdateMode.VALUE_CHANGED)
+            # submissions are only read when asked for (respondent columns, then the duplicated submissions)
+            if st.checkbox('Find Duplicates', key='duplicates_global'):
+                respondents = dm.get_table('submissions', ['KEY', 'PROV', 'KOTA_KAB', 'KEC', 'KEL', 'NAMA_KK', 'NAMA_RESPONDEN'])
+                keys = respondents[respondents.drop(['KEY'], axis=1).duplicated(keep=False)]['KEY']
+                data = dm.query_keys(keys).sort_values('NAMA_RESPONDEN')
+                height = get_table_height(data)
+                gb = GridOptionsBuilder.from_dataframe(data)
+                gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
+                gridOptions = gb.build()
+                gridOptions['context'] = get_grid_context(nama_survei, selected_category)
+                gridOptions['getRowStyle'] = jscode1
+                AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=False,
+                        allow_unsafe_jscode=True, height=height, 
+                        update_mode=GridUpdateMode.VALUE_CHANGED)
 
         # Duplicates By Kelurahan
         with tab2:
             usecols = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan', 'Target', 'Sample', 'Approved']
             data = dm.df_rekap_all[dm.df_rekap_all['Kelurahan'].duplicated(keep=False)][usecols].sort_values('Kelurahan')
             if len(data) > 0:
-                data['Kelurahan'] = data.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kab_kota={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&selected_kelurahan={x.Kelurahan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kelurahan}</a>', axis=1)
                 height = get_table_height(data)
                 gb = GridOptionsBuilder.from_dataframe(data)
                 gb.configure_column('Kelurahan', cellRenderer=cell_renderer_kel)
                 gb.configure_columns(['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan'], pinned='left')
                 gridOptions = gb.build()
+                gridOptions['context'] = get_grid_context(nama_survei, selected_category)
                 AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=True,
                         allow_unsafe_jscode=True, height=height, 
                         update_mode=GridUpdateMode.VALUE_CHANGED)
@@ -551,12 +548,12 @@ if st.session_state.authentication_status:
         with tab3:
             data = dm.df_rekap_all[dm.df_rekap_all['Target']==0][usecols].sort_values('Kelurahan')
             if len(data) > 0:
-                data['Kelurahan'] = data.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kab_kota={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&selected_kelurahan={x.Kelurahan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kelurahan}</a>', axis=1)
                 height = get_table_height(data)
                 gb = GridOptionsBuilder.from_dataframe(data)
                 gb.configure_column('Kelurahan', cellRenderer=cell_renderer_kel)
                 gb.configure_columns(['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan'], pinned='left')
                 gridOptions = gb.build()
+                gridOptions['context'] = get_grid_context(nama_survei, selected_category)
                 AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, fit_columns_on_grid_load=True,
                         allow_unsafe_jscode=True, height=height, 
                         update_mode=GridUpdateMode.VALUE_CHANGED)
@@ -567,10 +564,7 @@ if st.session_state.authentication_status:
 
     with st.expander('Rejected Enumerators (Unfiltered)'):
 
-        cols = ['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'NAMA_ENUM', 'review_status']
-        data = dm.df.groupby(cols).size().reset_index().sort_values([0, 'NAMA_ENUM'], ascending=False)
-        data.columns = cols + ['Rejected Count']
-        data = data[data['review_status']=='REJECTED'].drop(['review_status'], axis=1)
+        data = dm.get_rejected_enumerators()
         height = get_table_height(data)
 
         gb = GridOptionsBuilder.from_dataframe(data)
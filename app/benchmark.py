@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from datetime import datetime
+# datalakes built by the benchmarks are written to a temporary database
+TEMP_DIR = tempfile.TemporaryDirectory()
+os.environ['DB_PATH'] = os.path.join(TEMP_DIR.name, 'benchmark.db')
+os.environ['SNAPSHOT_DIR'] = os.path.join(TEMP_DIR.name, 'snapshots')
+from module import DB_PATH, SERVER_NAME, USECOLS, get_internal_decoder, process_data, generate_recaps, generate_tables, generate_datalake, datamart, get_targets, \
+    stage_tables, swap_tables, read_table, update_surveys_table
+from synthetic import get_hierarchy, get_hierarchy_labels, generate_submissions, generate_target_plan, write_target_plan, read_target_plan
+
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# Benchmarks on synthetic SurveyCTO data (run from the repository root):
+#   python app/benchmark.py process_data --rows 100000
+#   python app/benchmark.py datalake --rows 100000 --target-split
+#   python app/benchmark.py publish --rows 100000
+# Pipeline suite (one JSON line per size & stage, appended to --output):
+#   python app/benchmark.py suite --sizes 1000 10000 100000 500000 --categories 3 --output benchmark.jsonl
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# LEGACY IMPLEMENTATIONS (reference for before/after comparison)
+
+# row-wise post-processing of download_data before vectorization
+def process_data_legacy(df, wilayah, decoder):
+    if 'CATATAN_QC' not in df.columns:
+        df['CATATAN_QC'] = ''
+    usecols = USECOLS.copy()
+    cols_X = ['_'.join(i.split('_')[:-1]) for i in df.columns if i.split('_')[-1]=='X']
+    usecols += [i for i in cols_X if i not in usecols]
+    df.columns = ['_'.join(i.split('_')[:-1]) if i.split('_')[-1]=='X' else i for i in df.columns]
+    df = df[usecols].copy()
+    df['review_status'] = df['review_status'].replace('NONE', 'AWAITING')
+    internal_decoder = get_internal_decoder()
+    for f in internal_decoder.keys():
+        df.loc[:,f] = df[f].map(internal_decoder[f])
+        df[f] = df[f].fillna('TIDAK DIKENALI')
+        df[f] = df[f].str.upper()
+    if decoder is not None:
+        for f in decoder.keys():
+            df.loc[:,f] = df[f].map(decoder[f])
+            df[f] = df[f].fillna('TIDAK DIKENALI')
+            df[f] = df[f].str.upper()
+    for col in ['NAMA_RESPONDEN', 'NAMA_KK', 'NAMA_ENUM', 'PROV', 'KOTA_KAB', 'KEC', 'KEC_LAINNYA', 'KEL', 'KEL_LAINNYA']:
+        df.loc[:,col] = df[col].str.upper().str.strip()
+        df.loc[:,col] = df[col].str.rstrip()
+    for f in ['KEC', 'KEL']:
+        df[f] = df.apply(lambda x : x[f'{f}_LAINNYA'] if x[f] == 'TIDAK DIKENALI' else x[f], axis=1)
+    df['WILAYAH'] = df['KEL'].map(wilayah).values
+    df['Link'] = df['KEY'].apply(lambda x : x.split('uuid:')[-1])
+    df['Link'] = df['Link'].apply(lambda x : f'<a href="https://{SERVER_NAME}.surveycto.com/view/submission.html?uuid=uuid%3A{x}" target="_blank">link</a>')
+    return df.drop(['KEC_LAINNYA', 'KEL_LAINNYA'], axis=1)
+
+# recapitulation of a region level before the single-pass rollup (loc_id strings built with apply on every call)
+def get_recap_legacy(df, target_column, targets, region, metadata, all_regions=False):
+    reg = {'Provinsi': 'PROV', 'Kabupaten_Kota': 'KOTA_KAB', 'Kecamatan': 'KEC', 'Kelurahan': 'KEL'}
+    # generate location ids
+    if target_column is not None:
+        if region == 'Provinsi':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x[target_column]}', axis=1)
+        elif region == 'Kabupaten_Kota':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x[target_column]}', axis=1)
+        elif region == 'Kecamatan':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x[target_column]}', axis=1)
+        elif region == 'Kelurahan':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}_{x[target_column]}', axis=1)
+    else:
+        if region == 'Provinsi':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}', axis=1)
+        elif region == 'Kabupaten_Kota':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}', axis=1)
+        elif region == 'Kecamatan':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}', axis=1)
+        elif region == 'Kelurahan':
+            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}', axis=1)
+    # grouping
+    tmp1 = df.groupby('loc_id').size().reset_index()
+    tmp2 = df[df['review_status']=='APPROVED'].groupby('loc_id').size().reset_index()
+    tmp3 = df[df['review_status']=='REJECTED'].groupby('loc_id').size().reset_index()
+    # merging
+    tmp = pd.merge(tmp1, tmp2[['loc_id', 0]], how='left', on='loc_id').fillna(0)
+    recap = pd.merge(tmp, tmp3[['loc_id', 0]], how='left', on='loc_id').fillna(0)
+    recap.columns = [region, 'Sample', 'Approved', 'Rejected']
+    # set target
+    if target_column is not None:
+        recap[target_column] = recap[region].apply(lambda x : x.split('_')[-1])
+        # set target
+        recap['Target'] = 0
+        for cat in targets.keys():
+            idx = recap[recap[target_column]==cat].index
+            recap.loc[idx,'Target'] = recap.loc[idx,region].map(targets[cat][reg[region]]).values
+        newcols = [region, target_column, 'Target', 'Sample', 'Approved', 'Rejected']
+    else:
+        recap['Target'] = recap[region].map(targets[reg[region]]).values
+        newcols = [region, 'Target', 'Sample', 'Approved', 'Rejected'] 
+    recap = recap[newcols]
+    # add empty samples
+    row_indices = recap.index
+    idx = {'Provinsi': 0, 'Kabupaten_Kota': 1, 'Kecamatan': 2, 'Kelurahan': 3}
+    if target_column is not None:
+        tmp = metadata.melt(id_vars=['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'WILAYAH'], value_vars=[i for i in metadata.columns if i not in ['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'WILAYAH']])
+        ori = tmp.copy()
+        tmp['PROV'] = ori.apply(lambda x : f'{x.PROV}_{x.variable}', axis=1)
+        tmp['KOTA_KAB'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.variable}', axis=1)
+        tmp['KEC'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.variable}', axis=1)
+        tmp['KEL'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}_{x.variable}', axis=1)
+        for cat in targets.keys():
+            list_exist = recap[recap[target_column]==cat][region].unique().tolist() 
+            for ireg in [i for i in tmp[tmp['variable']==cat][reg[region]].unique() if i not in list_exist]:
+                if all_regions:
+                    kel = ireg.split('_')[3]
+                    kec = ireg.split('_')[2]
+                    kab = ireg.split('_')[1]
+                    prov = ireg.split('_')[0]
+                    vals = {'Provinsi': prov, 'Kabupaten_Kota': kab, 'Kecamatan': kec, 'Kelurahan': kel, target_column: cat, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[cat]['KEL'][ireg]}
+                else:
+                    vals = {region: ireg.split('_')[idx[region]], target_column: cat, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[cat][reg[region]][ireg]}
+                recap = recap.append(vals, ignore_index=True)
+    else:
+        metadata['PROV'] = metadata.apply(lambda x : f'{x.PROV}', axis=1)
+        metadata['KOTA_KAB'] = metadata.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}', axis=1)
+        metadata['KEC'] = metadata.apply(lambda x : f'{x.KOTA_KAB}_{x.KEC}', axis=1)
+        metadata['KEL'] = metadata.apply(lambda x : f'{x.KEC}_{x.KEL}', axis=1)  
+        list_exist = recap[region].unique().tolist() 
+        for ireg in [i for i in metadata[reg[region]].unique() if i not in list_exist]:
+            if all_regions:
+                kel = ireg.split('_')[3]
+                kec = ireg.split('_')[2]
+                kab = ireg.split('_')[1]
+                prov = ireg.split('_')[0]
+                vals = {'Provinsi': prov, 'Kabupaten_Kota': kab, 'Kecamatan': kec, 'Kelurahan': kel, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets['KEL'][ireg]}
+            else:
+                vals = {region: ireg.split('_')[idx[region]], 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[reg[region]][ireg]}
+            recap = recap.append(vals, ignore_index=True)
+    # restoration
+    if all_regions:
+        for ireg in idx.keys():
+            recap.loc[row_indices, ireg] = recap.loc[row_indices, 'Kelurahan'].apply(lambda x : x.split('_')[idx[ireg]])
+    else:
+        recap.loc[row_indices, region] = recap.loc[row_indices, region].apply(lambda x : x.split('_')[idx[region]])            
+    # add more features
+    recap['Awaiting'] = recap['Sample'] - recap['Approved'] - recap['Rejected']   
+    recap['Deficit'] = recap['Target'] - recap['Approved']
+    recap['Deficit'] = np.where(recap['Deficit']<0, 0, recap['Deficit'])
+    cols = ['Sample', 'Approved', 'Rejected', 'Awaiting', 'Target', 'Deficit']
+    recap[cols] = recap[cols].fillna(0).astype(int)
+    return recap.sort_values(region)
+
+# targets per underscore-joined location id, as parsed in Manage Data before location keys
+def get_targets_legacy(metadata, target_column, categories):
+    regions = ['PROV', 'KOTA_KAB', 'KEC', 'KEL']
+    if target_column is not None:
+        data = metadata.melt(id_vars=regions, value_vars=categories)
+        targets = {cat:{} for cat in categories}
+        for i, region in enumerate(regions):
+            data['loc_id'] = data[regions[:i+1] + ['variable']].astype(str).agg('_'.join, axis=1)
+            for cat in categories:
+                targets[cat].update({region : data[data['variable']==cat].groupby('loc_id').sum('value').to_dict()['value']})
+    else:
+        data = metadata.copy()
+        targets = {}
+        for i, region in enumerate(regions):
+            data['loc_id'] = data[regions[:i+1]].astype(str).agg('_'.join, axis=1)
+            targets.update({region : data.groupby('loc_id').sum('JML').to_dict()['JML']})
+    return targets
+
+# recapitulation tables before the single-pass rollup
+def generate_recaps_legacy(df, targets, target_column, metadata):
+    # -------------------------------------------------------------------------------------------------
+    
+    # tabel rekapitulasi (All, down to Kelurahan)
+    rekap = get_recap_legacy(df, target_column, targets, 'Kelurahan', metadata.copy(), all_regions=True)
+    
+    # reorder columns
+    if target_column is not None:
+        new_column_order = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan', target_column, 'Target', 'Sample', 'Approved', 'Deficit', 'Rejected', 'Awaiting']
+    else:
+        new_column_order = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan', 'Target', 'Sample', 'Approved', 'Deficit', 'Rejected', 'Awaiting']
+    rekap = rekap[new_column_order]
+
+    # -------------------------------------------------------------------------------------------------
+    
+    # table rekapitulasi up to provinsi level
+    rekap_prov = get_recap_legacy(df, target_column, targets, 'Provinsi', metadata.copy())
+
+    # get percentages
+    rekap_prov['Approved_percent'] = rekap_prov['Approved'] / rekap_prov['Sample'] * 100
+    rekap_prov['Rejected_percent'] = rekap_prov['Rejected'] / rekap_prov['Sample'] * 100
+    rekap_prov['Awaiting_percent'] = rekap_prov['Awaiting'] / rekap_prov['Sample'] * 100
+    rekap_prov['Target_percent'] = rekap_prov['Approved'] / rekap_prov['Target'] * 100
+    cols = ['Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
+    rekap_prov[cols] = rekap_prov[cols].fillna(0)
+    rekap_prov[cols] = rekap_prov[cols].round(1)
+
+    # reorder columns
+    if target_column is not None:
+        new_column_order = ['Provinsi', target_column, 'Sample', 'Target', 'Approved', 'Deficit', 'Rejected', 'Awaiting', 'Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
+    else:
+        new_column_order = ['Provinsi', 'Sample', 'Target', 'Approved', 'Deficit', 'Rejected', 'Awaiting', 'Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
+    rekap_prov = rekap_prov[new_column_order]
+
+    # -------------------------------------------------------------------------------------------------
+    
+    # table rekapitulasi up to kabupaten level
+    rekap_kab = get_recap_legacy(df, target_column, targets, 'Kabupaten_Kota', metadata.copy())
+
+    # -------------------------------------------------------------------------------------------------
+    
+    # table rekapitulasi up to kecamatan level
+    rekap_kec = get_recap_legacy(df, target_column, targets, 'Kecamatan', metadata.copy())
+
+    # -------------------------------------------------------------------------------------------------
+    
+    # table rekapitulasi up to kelurahan level
+    rekap_kel = get_recap_legacy(df, target_column, targets, 'Kelurahan', metadata.copy())
+
+    # -------------------------------------------------------------------------------------------------
+
+    return {'rekap_all': rekap, 'rekap_prov': rekap_prov, 'rekap_kab': rekap_kab, 'rekap_kec': rekap_kec, 'rekap_kel': rekap_kel}
+
+# one replace per table & survey (each table is committed separately)
+def publish_tables_legacy(conn, tables):
+    for table, data in tables.items():
+        data.to_sql(table, conn, if_exists='replace', index=False)
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# BENCHMARKS
+
+# best of n runs (input is copied before each run)
+def timeit(func, data, *args, repeat=3):
+    best, out = None, None
+    for _ in range(repeat):
+        df = data.copy()
+        start = time.perf_counter()
+        out = func(df, *args)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, out
+
+# peak memory of a run (MB, allocations traced by Python, numpy & pandas included)
+def peakit(func, data, *args):
+    df = data.copy()
+    tracemalloc.start()
+    func(df, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+# same rows & columns (order of rows with equal region names is not specified)
+def same_rows(a, b):
+    return a.sort_values(list(a.columns)).reset_index(drop=True).equals(b.sort_values(list(b.columns)).reset_index(drop=True))
+
+# download_data post-processing, before / after
+def bench_process_data(n_rows, repeat):
+    hierarchy = get_hierarchy()
+    data = generate_submissions(hierarchy, n_rows, n_locations=1000)
+    labels = get_hierarchy_labels(hierarchy.loc[hierarchy['KEL'].isin(data['KEL'])])
+    wilayah = {k: 'Rural' for k in labels['KEL']}
+    decoder = {f'Q{i + 1}': {str(j): f'answer {j}' for j in range(1, 6)} for i in range(5)}
+    get_internal_decoder()
+    seconds_legacy, out_legacy = timeit(process_data_legacy, data, wilayah, decoder, repeat=repeat)
+    seconds, out = timeit(process_data, data, wilayah, decoder, repeat=repeat)
+    print(f'process_data ({n_rows} rows)')
+    print(f'  legacy     : {seconds_legacy:.3f}s')
+    print(f'  vectorized : {seconds:.3f}s ({seconds_legacy / seconds:.1f}x)')
+    # links are rendered in the browser since the vectorized version
+    print(f'  identical  : {out.equals(out_legacy.drop(["Link"], axis=1))}')
+
+# recapitulation tables, before / after
+def bench_datalake(n_rows, repeat, target_split, n_planned):
+    target_column, categories = ('KATEGORI', ['PEMILIH', 'NON PEMILIH', 'PEMUDA']) if target_split else (None, None)
+    hierarchy = get_hierarchy()
+    data = generate_submissions(hierarchy, n_rows, n_locations=1000, target_column=target_column, categories=categories)
+    # planned kelurahan: the surveyed ones and n_planned without submission
+    planned = pd.concat([hierarchy[hierarchy['KEL'].isin(data['KEL'])], hierarchy[~hierarchy['KEL'].isin(data['KEL'])].sample(n_planned, random_state=0)])
+    metadata = generate_target_plan(get_hierarchy_labels(planned), target_column, categories)
+    wilayah = metadata.set_index('KEL')['WILAYAH'].to_dict()
+    df = process_data(data, wilayah, None)
+    seconds_legacy, out_legacy = timeit(generate_recaps_legacy, df, get_targets_legacy(metadata, target_column, categories), target_column, metadata, repeat=repeat)
+    seconds, out = timeit(generate_recaps, df, get_targets(metadata, target_column), target_column, repeat=repeat)
+    print(f"datalake ({n_rows} rows, {len(metadata)} planned kelurahan{', target split' if target_split else ''})")
+    print(f'  legacy     : {seconds_legacy:.3f}s')
+    print(f'  rollup     : {seconds:.3f}s ({seconds_legacy / seconds:.1f}x)')
+    # parent regions are added to the level tables since incremental recap updates
+    print(f"  identical  : {all(same_rows(out[k][out_legacy[k].columns], out_legacy[k]) for k in out)}")
+
+# publish of the datalake tables to SQLite, before / after
+def bench_publish(n_rows, repeat):
+    hierarchy = get_hierarchy()
+    data = generate_submissions(hierarchy, n_rows, n_locations=1000)
+    metadata = generate_target_plan(get_hierarchy_labels(hierarchy[hierarchy['KEL'].isin(data['KEL'])]))
+    df = process_data(data, metadata.set_index('KEL')['WILAYAH'].to_dict(), None)
+    tables = generate_tables(df, get_targets(metadata, None), None)
+    tables.update({'submissions': df, 'metadata': metadata})
+    # legacy tables have the names of the survey tables
+    legacy = {('bench' if name == 'submissions' else f'bench_{name}'): table for name, table in tables.items()}
+    with tempfile.TemporaryDirectory() as tmp:
+        def publish_legacy(tables):
+            conn = sqlite3.connect(os.path.join(tmp, 'legacy.db'))
+            publish_tables_legacy(conn, tables)
+            conn.close()
+        # staging tables written in one transaction, swapped in by a second one (as in generate_datalake)
+        def publish(tables):
+            conn = sqlite3.connect(os.path.join(tmp, 'staged.db'), isolation_level=None)
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            staged = stage_tables(cursor, 'bench', tables, None)
+            cursor.execute('COMMIT')
+            cursor.execute('BEGIN IMMEDIATE')
+            swap_tables(cursor, 'bench', staged)
+            cursor.execute('COMMIT')
+            conn.close()
+        # tables are replaced on every run (as on each refresh)
+        seconds_legacy, _ = timeit(lambda x : publish_legacy(legacy), df, repeat=repeat)
+        seconds, _ = timeit(lambda x : publish(tables), df, repeat=repeat)
+        identical = True
+        conn_legacy, conn = sqlite3.connect(os.path.join(tmp, 'legacy.db')), sqlite3.connect(os.path.join(tmp, 'staged.db'))
+        for table, table_legacy in zip(tables.keys(), legacy.keys()):
+            identical &= read_table(conn, table, 'bench').equals(pd.read_sql_query(f'SELECT * FROM [{table_legacy}]', conn_legacy))
+        conn_legacy.close()
+        conn.close()
+    print(f'publish ({n_rows} rows, {len(tables)} tables)')
+    print(f'  legacy     : {seconds_legacy:.3f}s')
+    print(f'  staged     : {seconds:.3f}s ({seconds_legacy / seconds:.1f}x)')
+    print(f'  identical  : {identical}')
+    # the staged publish must be faster than the independent replaces & store the same rows
+    if (seconds >= seconds_legacy) or (not identical):
+        raise SystemExit(f'publish: staged publish {"slower than legacy" if identical else "differs from legacy"}')
+
+# pipeline stages on a synthetic survey: download_data post-processing, recap tables, datalake build & datamart load
+def bench_suite(sizes, repeat, n_categories, status_mix, n_locations, memory, output):
+    target_column, categories = ('KATEGORI', [f'KATEGORI {i + 1}' for i in range(n_categories)]) if n_categories > 0 else (None, None)
+    hierarchy = get_hierarchy()
+    get_internal_decoder()
+    run = {'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(), 'pandas': pd.__version__}
+    for n_rows in sizes:
+        data = generate_submissions(hierarchy, n_rows, n_locations=n_locations, target_column=target_column, categories=categories, status_mix=status_mix)
+        # target plan of the surveyed kelurahan, through the template format uploaded in Manage Data
+        path = os.path.join(TEMP_DIR.name, 'target.xlsx')
+        write_target_plan(path, generate_target_plan(get_hierarchy_labels(hierarchy[hierarchy['KEL'].isin(data['KEL'])]), target_column, categories), target_column, categories)
+        metadata, target_column = read_target_plan(path)
+        wilayah = metadata.set_index('KEL')['WILAYAH'].to_dict()
+        targets = get_targets(metadata, target_column)
+        survey_name = f'benchmark_{n_rows}'
+        df = process_data(data.copy(), wilayah, None)
+        update_surveys_table(survey_name, 'benchmark', '{}', json.dumps(wilayah), None, target_column, None)
+        stages = {
+            'process_data': (lambda x : process_data(x, wilayah, None), data),
+            'recaps': (lambda x : generate_recaps(x, targets, target_column), df),
+            'datalake': (lambda x : generate_datalake(survey_name, x, targets, target_column, metadata), df),
+            # eager load of all tables (pages load them lazily through the datamart cache)
+            'datamart': (lambda x : datamart(DB_PATH, survey_name).load_all_tables(), df),
+        }
+        for stage, (func, data_in) in stages.items():
+            seconds, _ = timeit(func, data_in, repeat=repeat)
+            result = dict(run, stage=stage, rows=n_rows, categories=n_categories, locations=n_locations, seconds=round(seconds, 4),
+                          peak_mb=round(peakit(func, data_in), 1) if memory else None)
+            print(json.dumps(result))
+            if output is not None:
+                with open(output, 'a') as f:
+                    f.write(json.dumps(result) + '\n')
+
+# ----------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic SurveyCTO data')
+    parser.add_argument('benchmark', choices=['process_data', 'datalake', 'publish', 'suite'])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--target-split', action='store_true', help='targets split by category (datalake)')
+    parser.add_argument('--planned', type=int, default=1000, help='planned kelurahan without submission (datalake)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 500000], help='submission counts (suite)')
+    parser.add_argument('--categories', type=int, default=0, help='target categories, 0 without target column (suite)')
+    parser.add_argument('--status-mix', type=float, nargs=3, default=[0.6, 0.1, 0.3], help='approved, rejected & awaiting shares (suite)')
+    parser.add_argument('--locations', type=int, default=1000, help='surveyed kelurahan (suite)')
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory runs (suite)')
+    parser.add_argument('--output', default=None, help='JSON lines file results are appended to (suite)')
+    config = parser.parse_args()
+    if config.benchmark == 'process_data':
+        bench_process_data(config.rows, config.repeat)
+    elif config.benchmark == 'datalake':
+        bench_datalake(config.rows, config.repeat, config.target_split, config.planned)
+    elif config.benchmark == 'publish':
+        bench_publish(config.rows, config.repeat)
+    elif config.benchmark == 'suite':
+        bench_suite(config.sizes, config.repeat, config.categories, config.status_mix, config.locations, not config.no_memory, config.output)
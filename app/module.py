@@ -1,17 +1,33 @@
 import os
+import sys
+import copy
+import atexit
 import json
+import time
 import yaml
+import pickle
+import hashlib
+import shutil
 import sqlite3
+import requests
+import threading
 import numpy as np
 import pandas as pd
-from io import BytesIO
+import pyarrow as pa
+import pyarrow.compute as pc
+from io import BytesIO, StringIO
+from urllib.parse import quote
+from collections import OrderedDict
+from contextlib import contextmanager
 import streamlit as st
 import geopandas as gpd
 from st_aggrid import JsCode
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from yaml.loader import SafeLoader
 from pysurveycto import SurveyCTOObject
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 load_dotenv()
@@ -19,14 +35,191 @@ load_dotenv()
 WORK_DIR = 'app'
 JSON_DIR = 'app/json'
 IMG_DIR = 'app/images'
-DB_PATH = 'app/local.db'
+DB_PATH = os.getenv('DB_PATH', 'app/local.db')
 TEMPLATE_FILE = 'app/templates.zip'
 DECODER_FILE = 'app/decoder.xlsx'
+DECODER_CACHE = 'app/decoder.pkl'
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'app/snapshots')
 AUTHENTICATION_YAML = 'app/config_auth.yaml'
 SERVER_NAME = os.getenv('SERVER_NAME')
 DASHBOARD_HOST = os.getenv('DASHBOARD_HOST')
 SCTO_USERNAME = os.getenv('SCTO_USERNAME')
 SCTO_PASSWORD = os.getenv('SCTO_PASSWORD')
+SYNC_OVERLAP_MINUTES = int(os.getenv('SYNC_OVERLAP_MINUTES', 10))
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 60))
+SQLITE_CACHE_SIZE_MB = int(os.getenv('SQLITE_CACHE_SIZE_MB', 64))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB', 256))
+DATAMART_CACHE_MB = int(os.getenv('DATAMART_CACHE_MB', 2048))
+METRICS_RETENTION_DAYS = int(os.getenv('METRICS_RETENTION_DAYS', 30))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 10))
+METRICS_BUSY_TIMEOUT = float(os.getenv('METRICS_BUSY_TIMEOUT', 1))
+METRICS_BUFFER_ROWS = int(os.getenv('METRICS_BUFFER_ROWS', 10000))
+DOWNLOAD_FORMAT = os.getenv('DOWNLOAD_FORMAT', 'json')
+SCTO_CONNECT_TIMEOUT = float(os.getenv('SCTO_CONNECT_TIMEOUT', 10))
+SCTO_READ_TIMEOUT = float(os.getenv('SCTO_READ_TIMEOUT', 300))
+SCTO_MAX_RETRIES = int(os.getenv('SCTO_MAX_RETRIES', 5))
+SCTO_BACKOFF_FACTOR = float(os.getenv('SCTO_BACKOFF_FACTOR', 1))
+SCTO_POOL_SIZE = int(os.getenv('SCTO_POOL_SIZE', 8))
+# e.g. http://localhost:8000 to use the local stand-in server (app/scto_server.py)
+SCTO_BASE_URL = os.getenv('SCTO_BASE_URL')
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# SQLITE CONNECTIONS
+#   readers: one connection per thread, WAL readers are not blocked by the writer
+#   writer: a single connection per process, one write transaction at a time
+
+readers = threading.local()
+writers = {}
+writer_lock = threading.Lock()
+
+# open a connection (WAL journal & tuned pragmas), transactions are explicit
+def connect(db_path, check_same_thread=True, timeout=SQLITE_BUSY_TIMEOUT):
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}')
+    return conn
+
+# read connection of the current thread
+def get_reader(db_path=DB_PATH):
+    if not hasattr(readers, 'connections'):
+        readers.connections = {}
+    if db_path not in readers.connections:
+        readers.connections[db_path] = connect(db_path)
+    return readers.connections[db_path]
+
+# consistent snapshot of the database over several queries
+@contextmanager
+def read_snapshot(db_path=DB_PATH):
+    conn = get_reader(db_path)
+    conn.execute('BEGIN')
+    try:
+        yield conn
+    finally:
+        conn.execute('COMMIT')
+
+# write transaction on the writer connection, committed on exit or rolled back on error
+@contextmanager
+def get_writer(db_path=DB_PATH):
+    with writer_lock:
+        if db_path not in writers:
+            writers[db_path] = connect(db_path, check_same_thread=False)
+        conn = writers[db_path]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# METRICS
+
+tracing = threading.local()
+
+# id of a traced run: start time to the microsecond (runs started within the same second stay apart)
+def get_run_id():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+
+# start time of a run as displayed (to the second)
+def get_run_time(run):
+    return run[:19]
+
+# traced run of a survey (refresh, datamart load), the spans of the current thread are collected on exit: into the
+# given list (saved by the caller) or into the metrics buffer (saved in the background)
+@contextmanager
+def trace(survey_name, run=None, collect=None):
+    # nested traces belong to the run already open
+    if getattr(tracing, 'run', None) is not None:
+        yield
+        return
+    tracing.run = (survey_name, run if run is not None else get_run_id())
+    tracing.spans, tracing.open = [], []
+    try:
+        yield
+    finally:
+        (survey_name, run), spans = tracing.run, tracing.spans
+        tracing.run = None
+        rows = [(survey_name, run, i['Stage'], i['Seconds'], i['Rows'], i['Bytes']) for i in spans]
+        if collect is not None:
+            collect.extend(rows)
+        else:
+            buffer_metrics(rows)
+
+# timed stage of the traced run (no-op outside of a run), rows & bytes can be set on the yielded span
+@contextmanager
+def span(stage, rows=None, nbytes=None):
+    record = {'Stage': stage, 'Rows': rows, 'Bytes': nbytes}
+    if getattr(tracing, 'run', None) is None:
+        yield record
+        return
+    tracing.open.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['Seconds'] = time.perf_counter() - start
+        tracing.open.remove(record)
+        tracing.spans.append(record)
+
+# bytes transferred during the open spans of the current thread (downloads)
+def add_span_bytes(nbytes):
+    for record in getattr(tracing, 'open', []) if getattr(tracing, 'run', None) is not None else []:
+        record['Bytes'] = (record['Bytes'] or 0) + nbytes
+
+# metrics rows waiting to be saved (the latest ones are kept when the database stays locked)
+metrics_buffer = []
+metrics_lock = threading.Lock()
+_metrics_flusher = None
+
+# queue metrics rows, saved by a background thread (traced reads never wait on the writer)
+def buffer_metrics(rows):
+    global _metrics_flusher
+    with metrics_lock:
+        metrics_buffer.extend(rows)
+        del metrics_buffer[:-METRICS_BUFFER_ROWS]
+        if _metrics_flusher is None:
+            _metrics_flusher = threading.Thread(target=flush_metrics_loop, daemon=True)
+            _metrics_flusher.start()
+            atexit.register(flush_metrics)
+
+def flush_metrics_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush_metrics()
+
+# save the buffered rows (best effort): own connection with a short busy timeout, rows are put back on error
+def flush_metrics(db_path=DB_PATH):
+    with metrics_lock:
+        rows = metrics_buffer[:]
+        metrics_buffer.clear()
+    if len(rows) == 0:
+        return
+    conn = None
+    try:
+        conn = connect(db_path, timeout=METRICS_BUSY_TIMEOUT)
+        conn.execute('BEGIN IMMEDIATE')
+        save_metrics(conn, rows)
+        conn.execute('COMMIT')
+    except sqlite3.Error:
+        with metrics_lock:
+            metrics_buffer[:0] = rows
+            del metrics_buffer[:-METRICS_BUFFER_ROWS]
+    finally:
+        if conn is not None:
+            conn.close()
+
+# save metrics rows within the transaction of the connection, metrics older than the retention period are removed
+def save_metrics(conn, rows):
+    oldest = (datetime.now() - timedelta(days=METRICS_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?)', rows)
+    conn.executemany('DELETE FROM metrics WHERE "Survey Name" = ? AND Run < ?', [(i, oldest) for i in sorted(set([i[0] for i in rows]))])
+
+# stage timings of all surveys (latest runs first)
+def load_metrics():
+    return pd.read_sql_query('SELECT * FROM metrics ORDER BY Run DESC, rowid', get_reader())
 
 # ----------------------------------------------------------------------------------------------------------------------------
 # AUXILIARY FUNCTIONS
@@ -52,35 +245,61 @@ def get_table_height(data):
     else:
         return (1 + len(data)) * 30
 
-# create empty 'list_surveys' table
+# create empty 'list_surveys', 'datalake_state', 'datalake_snapshots' & 'metrics' tables
 def create_empty_table():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    sql_create_table = """
-        CREATE TABLE IF NOT EXISTS list_surveys (
-            Selection BOOLEAN,
-            "Survey Name" STR,
-            "Form ID" STR,
-            "Last Download" TIMESTAMP,
-            "List Location" TEXT,
-            Wilayah TEXT,
-            Target TEXT,
-            "Target Column" STR,
-            Decoder TEXT
-        );
-    """
-    cursor.execute(sql_create_table)
-    conn.commit()
-    conn.close()
+    with get_writer() as conn:
+        cursor = conn.cursor()
+        sql_create_table = """
+            CREATE TABLE IF NOT EXISTS list_surveys (
+                Selection BOOLEAN,
+                "Survey Name" STR,
+                "Form ID" STR,
+                "Last Download" TIMESTAMP,
+                "List Location" TEXT,
+                Wilayah TEXT,
+                Target TEXT,
+                "Target Column" STR,
+                Decoder TEXT
+            );
+        """
+        cursor.execute(sql_create_table)
+        # target plan fingerprint of the recap tables, per survey
+        sql_create_table = """
+            CREATE TABLE IF NOT EXISTS datalake_state (
+                "Survey Name" STR PRIMARY KEY,
+                Fingerprint TEXT,
+                "Last Build" TIMESTAMP
+            );
+        """
+        cursor.execute(sql_create_table)
+        # columnar snapshot of the datalake tables (datamart loading), per survey
+        sql_create_table = """
+            CREATE TABLE IF NOT EXISTS datalake_snapshots (
+                "Survey Name" STR PRIMARY KEY,
+                Path TEXT
+            );
+        """
+        cursor.execute(sql_create_table)
+        # stage timings of the refreshes & datamart loads
+        sql_create_table = """
+            CREATE TABLE IF NOT EXISTS metrics (
+                "Survey Name" STR,
+                Run TIMESTAMP,
+                Stage TEXT,
+                Seconds REAL,
+                Rows INTEGER,
+                Bytes INTEGER
+            );
+        """
+        cursor.execute(sql_create_table)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_run ON metrics ("Survey Name", Run)')
 
 # get surveys table
 def get_survey_names():
     # get table
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query(f'SELECT * FROM list_surveys', conn)
+    df = pd.read_sql_query(f'SELECT * FROM list_surveys', get_reader())
     df['Selection'] = df['Selection'].astype('bool')
     df = df.sort_values('Last Download', ascending=False)
-    conn.close()
     # get values
     list_surveys, download_time, targets = [], [], []
     for i in range(len(df)):
@@ -94,199 +313,289 @@ def get_survey_names():
 
 # update surveys table
 def update_surveys_table(survey_name, form_id, list_location, wilayah, targets, target_column, decoder):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     insert_sql = '''
         INSERT INTO list_surveys ("Selection", "Survey Name", "Form ID", "Last Download", "List Location", "Wilayah", "Target", "Target Column", "Decoder")
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
     '''
     update_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(insert_sql, (False, survey_name, form_id, update_time, list_location, wilayah, targets, target_column, decoder))
-    conn.commit()
-    conn.close()
+    with get_writer() as conn:
+        conn.execute(insert_sql, (False, survey_name, form_id, update_time, list_location, wilayah, targets, target_column, decoder))
 
-# internal decoder
-def get_internal_decoder():
-    fields = pd.read_excel(DECODER_FILE, sheet_name='FIELDS')
+# read internal decoder from excel file
+def read_internal_decoder():
+    xlsx = pd.ExcelFile(DECODER_FILE)
+    fields = pd.read_excel(xlsx, sheet_name='FIELDS')
     internal_decoder = {}
     for f in fields['FIELDS'].values:
-        out = pd.read_excel(DECODER_FILE, sheet_name=f)
+        out = pd.read_excel(xlsx, sheet_name=f)
         out['CODE'] = out['CODE'].astype('str')
         out = out.set_index('CODE').to_dict()['LABEL']
         internal_decoder.update({f: out})
     return internal_decoder
 
+# compiled internal decoder (pickle), recompiled when the content of the excel file changes
+def load_compiled_decoder(signature):
+    try:
+        with open(DECODER_CACHE, 'rb') as f:
+            compiled = pickle.load(f)
+    except Exception:
+        compiled = None
+    if (compiled is not None) and (compiled['signature'] == signature):
+        return compiled['decoder']
+    with open(DECODER_FILE, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if (compiled is None) or (compiled['sha1'] != digest):
+        compiled = {'sha1': digest, 'decoder': read_internal_decoder()}
+    # write to a temporary file first, the cache can be read by other processes
+    compiled['signature'] = signature
+    tmp = f'{DECODER_CACHE}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, DECODER_CACHE)
+    return compiled['decoder']
+
+_internal_decoder = None
+_internal_decoder_signature = None
+_internal_decoder_lock = threading.Lock()
+
+# internal decoder, loaded once per process
+def get_internal_decoder():
+    global _internal_decoder, _internal_decoder_signature
+    stat = os.stat(DECODER_FILE)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _internal_decoder_lock:
+        if (_internal_decoder is None) or (_internal_decoder_signature != signature):
+            _internal_decoder = load_compiled_decoder(signature)
+            _internal_decoder_signature = signature
+    return _internal_decoder
+
+# used fields (without the decoded '*_X' fields)
+USECOLS = ['CATATAN_QC', 'PROV', 'KOTA_KAB', 'KEC', 'KEC_LAINNYA', 'KEL', 'KEL_LAINNYA', 'RW', 'RT', 'NAMA_KK', 'NAMA_RESPONDEN', 'NAMA_ENUM', 'JK', 'WILAYAH', 'review_status', 'KEY']
+
+# parse wide csv export, only the used fields are parsed and all of them as strings (same as json)
+def read_csv_data(text):
+    header = pd.read_csv(StringIO(text.split('\n', 1)[0]), nrows=0).columns
+    usecols = [i for i in header if (i in USECOLS) or (i.split('_')[-1]=='X')]
+    dtype = {i: 'str' for i in usecols}
+    df = pd.read_csv(StringIO(text), usecols=usecols, dtype=dtype, engine='c', keep_default_na=False, na_filter=False)
+    # review status is empty for submissions that have not been reviewed
+    df['review_status'] = df['review_status'].str.upper().replace('', 'NONE')
+    return df
+
 # download
-def download_data(form_id, wilayah, decoder):
-    # build connection to SurveyCTO server
-    scto = SurveyCTOObject(SERVER_NAME, SCTO_USERNAME, SCTO_PASSWORD)
-    # donwload data as json
-    res = scto.get_form_data(form_id, format='json', shape='wide', review_status=['approved', 'rejected', 'pending'])
-    # build dataframe
-    df = pd.DataFrame(res)
+def download_data(form_id, wilayah, decoder, oldest_completion_date=None, data_format=DOWNLOAD_FORMAT):
+    # shared connection to SurveyCTO server
+    scto = get_scto_client()
+    with span('fetch'):
+        if oldest_completion_date is not None:
+            # only submissions completed after the given date (all review statuses, json only), older submissions
+            # re-reviewed since then are not returned: they are caught by the periodic full download (FULL_SYNC_EVERY)
+            res = scto.get_form_data_since(form_id, oldest_completion_date, review_status=['approved', 'rejected', 'pending'])
+        elif data_format == 'csv':
+            # download data as wide csv
+            res = scto.get_form_data(form_id, format='csv', shape='wide', review_status=['approved', 'rejected', 'pending'])
+        else:
+            # donwload data as json
+            res = scto.get_form_data(form_id, format='json', shape='wide', review_status=['approved', 'rejected', 'pending'])
+    if (oldest_completion_date is not None) and (len(res) == 0):
+        return None
+    with span('decode') as record:
+        df = read_csv_data(res) if (oldest_completion_date is None) and (data_format == 'csv') else pd.DataFrame(res)
+        del res
+        df = process_data(df, wilayah, decoder)
+        record['Rows'] = len(df)
+    return df
+
+# clean & decode downloaded data
+def process_data(df, wilayah, decoder):
     # used fields
     if 'CATATAN_QC' not in df.columns:
         df['CATATAN_QC'] = ''
-    usecols = ['CATATAN_QC', 'PROV', 'KOTA_KAB', 'KEC', 'KEC_LAINNYA', 'KEL', 'KEL_LAINNYA', 'RW', 'RT', 'NAMA_KK', 'NAMA_RESPONDEN', 'NAMA_ENUM', 'JK', 'WILAYAH', 'review_status', 'KEY']
+    usecols = USECOLS.copy()
     cols_X = ['_'.join(i.split('_')[:-1]) for i in df.columns if i.split('_')[-1]=='X']
     usecols += [i for i in cols_X if i not in usecols]
     # remove suffix 'X'
     df.columns = ['_'.join(i.split('_')[:-1]) if i.split('_')[-1]=='X' else i for i in df.columns]
     # filter
-    df = df[usecols]
+    df = df[usecols].copy()
     # fix empty data
     df['review_status'] = df['review_status'].replace('NONE', 'AWAITING')
     # decoding with internal decoder
     internal_decoder = get_internal_decoder()
     for f in internal_decoder.keys():
-        df.loc[:,f] = df[f].map(internal_decoder[f])
-        df[f] = df[f].fillna('TIDAK DIKENALI')
-        df[f] = df[f].str.upper()
+        df[f] = decode_column(df[f], internal_decoder[f])
     # decoding with external decoder
     if decoder is not None:
         for f in decoder.keys():
-            df.loc[:,f] = df[f].map(decoder[f])
-            df[f] = df[f].fillna('TIDAK DIKENALI')
-            df[f] = df[f].str.upper()
+            df[f] = decode_column(df[f], decoder[f])
     # apply uppercase and remove whitespace at the beginning and at the end of the strings
     for col in ['NAMA_RESPONDEN', 'NAMA_KK', 'NAMA_ENUM', 'PROV', 'KOTA_KAB', 'KEC', 'KEC_LAINNYA', 'KEL', 'KEL_LAINNYA']:
-        df.loc[:,col] = df[col].str.upper().str.strip()
-        df.loc[:,col] = df[col].str.rstrip()
+        df[col] = map_unique(df[col], lambda x : x.str.upper().str.strip())
     # fix "LAINNYA" in KEC & KEL
     for f in ['KEC', 'KEL']:
-        df[f] = df.apply(lambda x : x[f'{f}_LAINNYA'] if x[f] == 'TIDAK DIKENALI' else x[f], axis=1)
+        df[f] = df[f].mask(df[f] == 'TIDAK DIKENALI', df[f'{f}_LAINNYA'])
     # WILAYAH
     df['WILAYAH'] = df['KEL'].map(wilayah).values
-    # link KEY to Survey CTO server
-    df['Link'] = df['KEY'].apply(lambda x : x.split('uuid:')[-1])
-    df['Link'] = df['Link'].apply(lambda x : f'<a href="https://{SERVER_NAME}.surveycto.com/view/submission.html?uuid=uuid%3A{x}" target="_blank">link</a>')
-    return df.drop(['KEC_LAINNYA', 'KEL_LAINNYA', 'KEY'], axis=1)
+    # KEY is kept as the primary key of the survey table (incremental sync),
+    # links to the SurveyCTO server are built from KEY in the browser (cell_link)
+    return df.drop(['KEC_LAINNYA', 'KEL_LAINNYA'], axis=1)
+
+# apply a function on the unique values of a column only, missing values are replaced with 'missing'
+def map_unique(values, func, missing=np.nan):
+    codes, uniques = pd.factorize(values)
+    out = np.append(func(pd.Series(uniques, dtype='object')).values.astype('object'), [missing])
+    # missing values have code -1 (last item)
+    return pd.Series(out[codes], index=values.index)
+
+# decode a column (codes are mapped once per unique value)
+def decode_column(values, mapping):
+    return map_unique(values, lambda x : x.map(mapping).fillna('TIDAK DIKENALI').str.upper(), missing='TIDAK DIKENALI')
+
+# get high-water mark for incremental download
+def get_high_water_mark(last_download):
+    # 'Last Download' is stored in local time, SurveyCTO expects UTC
+    mark = datetime.strptime(last_download, '%Y-%m-%d %H:%M:%S').astimezone(timezone.utc)
+    # overlap protects against clock skew, re-downloaded rows are replaced by KEY
+    # the mark applies to the completion date only (no review date in the API): review status changes of
+    # submissions completed before it are picked up by the next full download
+    return mark - timedelta(minutes=SYNC_OVERLAP_MINUTES)
+
+# upsert new or re-reviewed submissions into the survey table, keyed on KEY, within the transaction of the cursor
+def upsert_survey_table(cursor, survey_name, df_new, target_column):
+    with span('upsert', rows=len(df_new)):
+        conn = cursor.connection
+        table = get_table_name('submissions', survey_name)
+        columns = [i[1] for i in cursor.execute(f'PRAGMA table_info([{table}])').fetchall()]
+        # survey table not built yet, built before KEY was stored or form has new fields: full download required
+        if ('KEY' not in columns) or (len([i for i in df_new.columns if i not in columns]) > 0):
+            return None
+        # remove the previous version of the submissions
+        cursor.execute('DROP TABLE IF EXISTS temp.new_keys')
+        cursor.execute('CREATE TEMP TABLE new_keys (KEY TEXT PRIMARY KEY)')
+        cursor.executemany('INSERT OR IGNORE INTO new_keys VALUES (?)', [(k,) for k in df_new['KEY'].values])
+        df_old = read_table(conn, 'submissions', survey_name, where='t.KEY IN (SELECT KEY FROM new_keys)')
+        if len(df_old) == 0:
+            df_old = pd.DataFrame(columns=columns)
+        cursor.execute(f'DELETE FROM [{table}] WHERE KEY IN (SELECT KEY FROM new_keys)')
+        cursor.execute('DROP TABLE temp.new_keys')
+        # insert new version
+        insert_rows(cursor, table, df_new)
+    # previous version of the upserted submissions (recap deltas)
+    return df_old
+
+# load submissions of a survey (full recapitulation)
+def load_survey_table(survey_name):
+    return read_table(get_reader(), 'submissions', survey_name)
+
+# load target plan of a survey
+def load_metadata(survey_name):
+    return read_table(get_reader(), 'metadata', survey_name)
 
 # build recapitulation table
-def get_recap(df, target_column, targets, region, metadata, all_regions=False):
-    reg = {'Provinsi': 'PROV', 'Kabupaten_Kota': 'KOTA_KAB', 'Kecamatan': 'KEC', 'Kelurahan': 'KEL'}
-    # generate location ids
-    if target_column is not None:
-        if region == 'Provinsi':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x[target_column]}', axis=1)
-        elif region == 'Kabupaten_Kota':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x[target_column]}', axis=1)
-        elif region == 'Kecamatan':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x[target_column]}', axis=1)
-        elif region == 'Kelurahan':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}_{x[target_column]}', axis=1)
-    else:
-        if region == 'Provinsi':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}', axis=1)
-        elif region == 'Kabupaten_Kota':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}', axis=1)
-        elif region == 'Kecamatan':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}', axis=1)
-        elif region == 'Kelurahan':
-            df['loc_id'] = df.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}', axis=1)
-    # grouping
-    tmp1 = df.groupby('loc_id').size().reset_index()
-    tmp2 = df[df['review_status']=='APPROVED'].groupby('loc_id').size().reset_index()
-    tmp3 = df[df['review_status']=='REJECTED'].groupby('loc_id').size().reset_index()
-    # merging
-    tmp = pd.merge(tmp1, tmp2[['loc_id', 0]], how='left', on='loc_id').fillna(0)
-    recap = pd.merge(tmp, tmp3[['loc_id', 0]], how='left', on='loc_id').fillna(0)
-    recap.columns = [region, 'Sample', 'Approved', 'Rejected']
-    # set target
-    if target_column is not None:
-        recap[target_column] = recap[region].apply(lambda x : x.split('_')[-1])
-        # set target
-        recap['Target'] = 0
-        for cat in targets.keys():
-            idx = recap[recap[target_column]==cat].index
-            recap.loc[idx,'Target'] = recap.loc[idx,region].map(targets[cat][reg[region]]).values
-        newcols = [region, target_column, 'Target', 'Sample', 'Approved', 'Rejected']
-    else:
-        recap['Target'] = recap[region].map(targets[reg[region]]).values
-        newcols = [region, 'Target', 'Sample', 'Approved', 'Rejected'] 
-    recap = recap[newcols]
-    # add empty samples
-    row_indices = recap.index
-    idx = {'Provinsi': 0, 'Kabupaten_Kota': 1, 'Kecamatan': 2, 'Kelurahan': 3}
+# recap levels, region column -> location field
+REGIONS = {'Provinsi': 'PROV', 'Kabupaten_Kota': 'KOTA_KAB', 'Kecamatan': 'KEC', 'Kelurahan': 'KEL'}
+
+# aggregate submissions once at the finest grain (kelurahan x category), counted by review status
+def aggregate_submissions(df, target_column):
+    keys = list(REGIONS.values()) + ([target_column] if target_column is not None else [])
+    status = df['review_status'].values
+    counts = pd.DataFrame({'Sample': 1, 'Approved': status=='APPROVED', 'Rejected': status=='REJECTED'}, index=df.index)
+    counts[keys] = df[keys]
+    counts = counts.groupby(keys, dropna=False, sort=False)[['Sample', 'Approved', 'Rejected']].sum().reset_index()
+    # locations are labels (missing values included)
+    counts[keys] = counts[keys].astype(str)
+    return counts
+
+# target plan per location, indexed by (PROV, KOTA_KAB, KEC, KEL[, target column]) at kelurahan level
+def get_targets(metadata, target_column):
+    keys = list(REGIONS.values())
     if target_column is not None:
-        tmp = metadata.melt(id_vars=['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'WILAYAH'], value_vars=[i for i in metadata.columns if i not in ['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'WILAYAH']])
-        ori = tmp.copy()
-        tmp['PROV'] = ori.apply(lambda x : f'{x.PROV}_{x.variable}', axis=1)
-        tmp['KOTA_KAB'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.variable}', axis=1)
-        tmp['KEC'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.variable}', axis=1)
-        tmp['KEL'] = ori.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}_{x.variable}', axis=1)
-        for cat in targets.keys():
-            list_exist = recap[recap[target_column]==cat][region].unique().tolist() 
-            for ireg in [i for i in tmp[tmp['variable']==cat][reg[region]].unique() if i not in list_exist]:
-                if all_regions:
-                    kel = ireg.split('_')[3]
-                    kec = ireg.split('_')[2]
-                    kab = ireg.split('_')[1]
-                    prov = ireg.split('_')[0]
-                    vals = {'Provinsi': prov, 'Kabupaten_Kota': kab, 'Kecamatan': kec, 'Kelurahan': kel, target_column: cat, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[cat]['KEL'][ireg]}
-                else:
-                    vals = {region: ireg.split('_')[idx[region]], target_column: cat, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[cat][reg[region]][ireg]}
-                recap = recap.append(vals, ignore_index=True)
-    else:
-        metadata['PROV'] = metadata.apply(lambda x : f'{x.PROV}', axis=1)
-        metadata['KOTA_KAB'] = metadata.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}', axis=1)
-        metadata['KEC'] = metadata.apply(lambda x : f'{x.KOTA_KAB}_{x.KEC}', axis=1)
-        metadata['KEL'] = metadata.apply(lambda x : f'{x.KEC}_{x.KEL}', axis=1)  
-        list_exist = recap[region].unique().tolist() 
-        for ireg in [i for i in metadata[reg[region]].unique() if i not in list_exist]:
-            if all_regions:
-                kel = ireg.split('_')[3]
-                kec = ireg.split('_')[2]
-                kab = ireg.split('_')[1]
-                prov = ireg.split('_')[0]
-                vals = {'Provinsi': prov, 'Kabupaten_Kota': kab, 'Kecamatan': kec, 'Kelurahan': kel, 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets['KEL'][ireg]}
-            else:
-                vals = {region: ireg.split('_')[idx[region]], 'Sample': 0, 'Approved': 0, 'Rejected': 0, 'Target': targets[reg[region]][ireg]}
-            recap = recap.append(vals, ignore_index=True)
-    # restoration
-    if all_regions:
-        for ireg in idx.keys():
-            recap.loc[row_indices, ireg] = recap.loc[row_indices, 'Kelurahan'].apply(lambda x : x.split('_')[idx[ireg]])
+        categories = [i for i in metadata.columns if i not in keys + ['WILAYAH']]
+        data = metadata.melt(id_vars=keys, value_vars=categories, var_name=target_column, value_name='Target')
+        keys += [target_column]
     else:
-        recap.loc[row_indices, region] = recap.loc[row_indices, region].apply(lambda x : x.split('_')[idx[region]])            
-    # add more features
+        data = metadata.rename(columns={'JML': 'Target'})
+    # locations are labels, as in aggregated submissions
+    data[keys] = data[keys].astype(str)
+    return data.groupby(keys, dropna=False, sort=False)['Target'].sum()
+
+# targets are saved (list_surveys) as JSON rows [PROV, KOTA_KAB, KEC, KEL, (category,) target]
+def dump_targets(targets):
+    return targets.reset_index().to_json(orient='values')
+
+def load_targets(text, target_column):
+    data = json.loads(text)
+    # targets per underscore-joined location id (previous format), to be rebuilt from metadata
+    if isinstance(data, dict):
+        return None
+    keys = list(REGIONS.values()) + ([target_column] if target_column is not None else [])
+    return pd.DataFrame(data, columns=keys + ['Target']).set_index(keys)['Target']
+
+# recapitulation of a region level (with parent regions), rolled up from the aggregated submissions
+def get_recap(counts, target_column, targets, region):
+    with span(f'recap {region}') as record:
+        levels = list(REGIONS.keys())
+        regions = levels[:levels.index(region)+1]
+        fields = [REGIONS[i] for i in regions] + ([target_column] if target_column is not None else [])
+        # rollup
+        recap = counts.groupby(fields)[['Sample', 'Approved', 'Rejected']].sum()
+        # set target, planned locations without any submission are added by the outer join
+        target = targets.groupby(level=fields).sum()
+        recap = recap.join(target.rename('Target'), how='outer')
+        recap[['Sample', 'Approved', 'Rejected']] = recap[['Sample', 'Approved', 'Rejected']].fillna(0)
+        # restore region columns
+        recap = recap.reset_index().rename(columns={REGIONS[i]: i for i in regions})
+        newcols = ([target_column] if target_column is not None else []) + ['Target', 'Sample', 'Approved', 'Rejected']
+        recap = add_features(recap[regions + newcols].copy())
+        record['Rows'] = len(recap)
+    return recap.sort_values(region)
+
+# awaiting & deficit
+def add_features(recap):
     recap['Awaiting'] = recap['Sample'] - recap['Approved'] - recap['Rejected']   
     recap['Deficit'] = recap['Target'] - recap['Approved']
     recap['Deficit'] = np.where(recap['Deficit']<0, 0, recap['Deficit'])
     cols = ['Sample', 'Approved', 'Rejected', 'Awaiting', 'Target', 'Deficit']
     recap[cols] = recap[cols].fillna(0).astype(int)
-    return recap.sort_values(region)
+    return recap
 
+# percentages (provinsi level)
+def add_percentages(rekap_prov):
+    rekap_prov['Approved_percent'] = rekap_prov['Approved'] / rekap_prov['Sample'] * 100
+    rekap_prov['Rejected_percent'] = rekap_prov['Rejected'] / rekap_prov['Sample'] * 100
+    rekap_prov['Awaiting_percent'] = rekap_prov['Awaiting'] / rekap_prov['Sample'] * 100
+    rekap_prov['Target_percent'] = rekap_prov['Approved'] / rekap_prov['Target'] * 100
+    cols = ['Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
+    rekap_prov[cols] = rekap_prov[cols].fillna(0)
+    rekap_prov[cols] = rekap_prov[cols].round(1)
+    return rekap_prov
 
+# generate recapitulation tables (all, provinsi, kabupaten, kecamatan & kelurahan levels)
+def generate_recaps(df, targets, target_column):
 
-# generate datalake
-def generate_datalake(survey_name, df, targets, target_column, metadata):
+    # -------------------------------------------------------------------------------------------------
+    
+    # submissions aggregated once (kelurahan x category x review status), recap tables are rolled up from it
+    counts = aggregate_submissions(df, target_column)
 
     # -------------------------------------------------------------------------------------------------
     
-    # tabel rekapitulasi (All, down to Kelurahan)
-    rekap = get_recap(df, target_column, targets, 'Kelurahan', metadata.copy(), all_regions=True)
+    # table rekapitulasi up to kelurahan level
+    rekap_kel = get_recap(counts, target_column, targets, 'Kelurahan')
+
+    # -------------------------------------------------------------------------------------------------
     
-    # reorder columns
+    # tabel rekapitulasi (All, down to Kelurahan)
     if target_column is not None:
         new_column_order = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan', target_column, 'Target', 'Sample', 'Approved', 'Deficit', 'Rejected', 'Awaiting']
     else:
         new_column_order = ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan', 'Target', 'Sample', 'Approved', 'Deficit', 'Rejected', 'Awaiting']
-    rekap = rekap[new_column_order]
+    rekap = rekap_kel[new_column_order]
 
     # -------------------------------------------------------------------------------------------------
     
     # table rekapitulasi up to provinsi level
-    rekap_prov = get_recap(df, target_column, targets, 'Provinsi', metadata.copy())
-
-    # get percentages
-    rekap_prov['Approved_percent'] = rekap_prov['Approved'] / rekap_prov['Sample'] * 100
-    rekap_prov['Rejected_percent'] = rekap_prov['Rejected'] / rekap_prov['Sample'] * 100
-    rekap_prov['Awaiting_percent'] = rekap_prov['Awaiting'] / rekap_prov['Sample'] * 100
-    rekap_prov['Target_percent'] = rekap_prov['Approved'] / rekap_prov['Target'] * 100
-    cols = ['Approved_percent', 'Rejected_percent', 'Awaiting_percent', 'Target_percent']
-    rekap_prov[cols] = rekap_prov[cols].fillna(0)
-    rekap_prov[cols] = rekap_prov[cols].round(1)
+    rekap_prov = add_percentages(get_recap(counts, target_column, targets, 'Provinsi'))
 
     # reorder columns
     if target_column is not None:
@@ -298,54 +607,447 @@ def generate_datalake(survey_name, df, targets, target_column, metadata):
     # -------------------------------------------------------------------------------------------------
     
     # table rekapitulasi up to kabupaten level
-    rekap_kab = get_recap(df, target_column, targets, 'Kabupaten_Kota', metadata.copy())
+    rekap_kab = get_recap(counts, target_column, targets, 'Kabupaten_Kota')
 
     # -------------------------------------------------------------------------------------------------
     
     # table rekapitulasi up to kecamatan level
-    rekap_kec = get_recap(df, target_column, targets, 'Kecamatan', metadata.copy())
+    rekap_kec = get_recap(counts, target_column, targets, 'Kecamatan')
 
-    # -------------------------------------------------------------------------------------------------
-    
-    # table rekapitulasi up to kelurahan level
-    rekap_kel = get_recap(df, target_column, targets, 'Kelurahan', metadata.copy())
+    return {'rekap_all': rekap, 'rekap_prov': rekap_prov, 'rekap_kab': rekap_kab, 'rekap_kec': rekap_kec, 'rekap_kel': rekap_kel}
 
-    # -------------------------------------------------------------------------------------------------
-    
-    # save to DB
-    conn = sqlite3.connect(DB_PATH)
-    df.drop(['loc_id'], axis=1).to_sql(survey_name, conn, if_exists='replace', index=False)
-    metadata.to_sql(f'{survey_name}_metadata', conn, if_exists='replace', index=False)
-    rekap.to_sql(f'{survey_name}_rekap_all', conn, if_exists='replace', index=False)
-    rekap_prov.to_sql(f'{survey_name}_rekap_prov', conn, if_exists='replace', index=False)
-    rekap_kab.to_sql(f'{survey_name}_rekap_kab', conn, if_exists='replace', index=False) 
-    rekap_kec.to_sql(f'{survey_name}_rekap_kec', conn, if_exists='replace', index=False)  
-    rekap_kel.to_sql(f'{survey_name}_rekap_kel', conn, if_exists='replace', index=False)  
-    conn.close()
+# roll up kelurahan level counts to every location node (any level, 'ALL' below the node level)
+def get_nodes(data, dims, values):
+    keys = list(REGIONS.values())
+    nodes = []
+    for i in range(len(keys) + 1):
+        if len(keys[:i] + dims) > 0:
+            node = data.groupby(keys[:i] + dims)[values].sum().reset_index()
+        else:
+            node = data[values].sum().to_frame().T
+        node[keys[i:]] = 'ALL'
+        nodes.append(node[keys + dims + values])
+    return pd.concat(nodes, ignore_index=True)
+
+# review status counts per location node and category
+def get_status_cube(df, target_column):
+    keys = list(REGIONS.values())
+    dims = ([target_column] if target_column is not None else []) + ['review_status']
+    cube = df.groupby(keys + dims, dropna=False).size().rename('Count').reset_index()
+    cube[keys + dims] = cube[keys + dims].astype(str)
+    return get_nodes(cube, dims, ['Count'])
+
+# distinct respondents, KK and enumerators (names are counted per kelurahan)
+DISTINCT_COUNTS = {'Responden': ['NAMA_KK', 'NAMA_RESPONDEN'], 'KK': ['NAMA_KK'], 'Enumerator': ['NAMA_ENUM']}
+
+# kelurahan level distinct counts per category
+def get_distinct_counts(df, target_column):
+    keys = list(REGIONS.values()) + ([target_column] if target_column is not None else [])
+    counts = []
+    for name, cols in DISTINCT_COUNTS.items():
+        # submissions with missing location or names are not counted
+        data = df[keys + cols].dropna(subset=list(REGIONS.values()) + cols).drop_duplicates()
+        counts.append(data.groupby(keys, dropna=False).size().rename(name))
+    counts = pd.concat(counts, axis=1).fillna(0).astype(int).reset_index()
+    counts[keys] = counts[keys].astype(str)
+    return counts
+
+# distinct counts per location node and category
+def get_distinct_cube(df, target_column):
+    dims = [target_column] if target_column is not None else []
+    return get_nodes(get_distinct_counts(df, target_column), dims, list(DISTINCT_COUNTS.keys()))
+
+# review status counts per enumerator (kelurahan level)
+def get_enumerator_cube(df):
+    keys = list(REGIONS.values()) + ['NAMA_ENUM', 'review_status']
+    cube = df.groupby(keys, dropna=False).size().rename('Count').reset_index()
+    cube[keys] = cube[keys].astype(str)
+    return cube
+
+# generate pre-aggregated count tables (status cube)
+def generate_cubes(df, target_column):
+    return {'cube': get_status_cube(df, target_column), 'cube_enum': get_enumerator_cube(df)}
+
+# generate all tables of the datalake from submissions
+def generate_tables(df, targets, target_column):
+    tables = generate_recaps(df, targets, target_column)
+    with span('cubes', rows=len(df)):
+        tables.update(generate_cubes(df, target_column))
+    with span('distinct counts', rows=len(df)):
+        tables['cube_distinct'] = get_distinct_cube(df, target_column)
+    return tables
+
+# fingerprint of the target plan (targets are derived from metadata), recap tables are rebuilt when it changes
+def get_plan_fingerprint(targets, target_column):
+    text = json.dumps([dump_targets(targets), target_column])
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# generate datalake
+def generate_datalake(survey_name, df, targets, target_column, metadata, save_raw=True):
+
+    tables = generate_tables(df, targets, target_column)
+    tables['metadata'] = metadata
+    tables['submissions'] = df
+
+    # save to DB: the new version is written into staging tables, then swapped in at once by a short transaction
+    with get_writer() as conn:
+        staged = stage_tables(conn.cursor(), survey_name, {k: v for k, v in tables.items() if save_raw or (k != 'submissions')}, target_column)
+    snapshot = save_snapshot(survey_name, tables)
+    with get_writer() as conn:
+        cursor = conn.cursor()
+        swap_tables(cursor, survey_name, staged)
+        register_snapshot(cursor, survey_name, snapshot)
+        # target plan the recap tables are built with (incremental updates), build time is the version of the datalake
+        build_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        cursor.execute('INSERT OR REPLACE INTO datalake_state VALUES (?, ?, ?)', (survey_name, get_plan_fingerprint(targets, target_column), build_time))
+
+# datalake tables: one table per survey & kind (fields differ between forms, target columns between surveys), named
+# after the survey (submissions) or '<survey>_<kind>', deleting a survey drops its tables
+DATALAKE_TABLES = ['submissions', 'metadata', 'rekap_all', 'rekap_prov', 'rekap_kab', 'rekap_kec', 'rekap_kel', 'cube', 'cube_enum', 'cube_distinct']
+
+# survey names taken by the database tables (survey tables are named after the survey)
+def is_reserved_name(survey_name):
+    return (survey_name in ['list_surveys', 'datalake_state', 'datalake_snapshots', 'metrics']) or ('_staging_' in survey_name) \
+        or any([survey_name.endswith(f'_{i}') for i in DATALAKE_TABLES])
+
+# name of the datalake table of a survey
+def get_table_name(table, survey_name):
+    return survey_name if table == 'submissions' else f'{survey_name}_{table}'
 
+# read the rows of a survey from a datalake table (table order), all columns or a projection
+def read_table(conn, table, survey_name, where='1', params=(), columns=None):
+    fields = ', '.join([f't.[{i}]' for i in columns]) if columns is not None else 't.*'
+    return pd.read_sql_query(f'SELECT {fields} FROM [{get_table_name(table, survey_name)}] t WHERE {where} ORDER BY t.rowid', conn, params=tuple(params))
+
+# read the rows matching the affected keys (location, category), with their rowid
+def read_affected(conn, table, survey_name, affected):
+    cursor = conn.cursor()
+    keys = list(affected.columns)
+    cursor.execute('DROP TABLE IF EXISTS temp.affected')
+    cursor.execute(f'CREATE TEMP TABLE affected ({", ".join([f"[{i}] TEXT" for i in keys])})')
+    cursor.executemany(f'INSERT INTO temp.affected VALUES ({", ".join(["?"] * len(keys))})', get_records(affected, keys))
+    on = ' AND '.join([f't.[{i}] IS a.[{i}]' for i in keys])
+    data = pd.read_sql_query(f'SELECT t.rowid AS row_id, t.* FROM [{get_table_name(table, survey_name)}] t JOIN temp.affected a ON {on}', conn)
+    cursor.execute('DROP TABLE temp.affected')
+    return data
+
+# write the tables of a survey into staging tables (bulk inserts, indexes built after), within the transaction of the
+# cursor, returns the staging tables
+def stage_tables(cursor, survey_name, tables, target_column):
+    build = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    staged = {}
+    for table, data in tables.items():
+        with span(f'publish {table}', rows=len(data)) as record:
+            staging = f'{survey_name}_staging_{table}'
+            cursor.execute(f'DROP TABLE IF EXISTS [{staging}]')
+            used = get_used_bytes(cursor)
+            create_table(cursor, staging, data)
+            insert_rows(cursor, staging, data)
+            # tables are renamed into place, their indexes are named after the build (index names cannot change)
+            create_table(cursor, staging, data, get_indexes(table, target_column), f'{get_table_name(table, survey_name)}_{build}')
+            # rows & indexes written to the database file
+            record['Bytes'] = get_used_bytes(cursor) - used
+            staged[table] = staging
+    return staged
+
+# swap the staging tables in by renaming them, within the transaction of the cursor
+def swap_tables(cursor, survey_name, staged):
+    with span('swap', rows=len(staged)):
+        for table, staging in staged.items():
+            name = get_table_name(table, survey_name)
+            cursor.execute(f'DROP TABLE IF EXISTS [{name}]')
+            cursor.execute(f'ALTER TABLE [{staging}] RENAME TO [{name}]')
+
+# size of the database pages in use (free pages excluded), as seen by the transaction of the cursor
+def get_used_bytes(cursor):
+    pages = cursor.execute('PRAGMA page_count').fetchone()[0] - cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    return pages * cursor.execute('PRAGMA page_size').fetchone()[0]
+
+# bound parameters of a statement (999 before SQLite 3.32)
+MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
+
+# bulk insert, up to 500 rows per statement (fewer statement steps & bindings from python)
+def insert_rows(cursor, table, data):
+    columns = ', '.join([f'[{i}]' for i in data.columns])
+    row = f'({", ".join(["?"] * len(data.columns))})'
+    size = max(1, min(500, MAX_VARIABLES // len(data.columns)))
+    # parameters of each statement are sliced from the flat values (no nested lists of rows)
+    values = data.to_numpy(dtype=object).reshape(-1)
+    step = size * len(data.columns)
+    n = len(data) // size * step
+    cursor.executemany(f'INSERT INTO [{table}] ({columns}) VALUES {", ".join([row] * size)}', (values[i:i + step].tolist() for i in range(0, n, step)))
+    cursor.executemany(f'INSERT INTO [{table}] ({columns}) VALUES {row}', (values[i:i + len(data.columns)].tolist() for i in range(n, len(values), len(data.columns))))
+
+# create a datalake table (columns of the rows first published) & its indexes (named after the table or the given prefix)
+def create_table(cursor, table, data, indexes={}, prefix=None):
+    # schema of the rows only for a new table (column types are inferred from the values)
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE", (table,)).fetchone() is None:
+        cursor.execute(pd.io.sql.get_schema(data, table, con=cursor.connection))
+    for name, columns in indexes.items():
+        # survey tables built before KEY was stored
+        if all([i in data.columns for i in columns]):
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS [idx_{prefix if prefix is not None else table}_{name}] ON [{table}] ({", ".join([f"[{i}]" for i in columns])})')
+
+# indexes of a datalake table: the survey table is indexed for location filters & upserts, the other tables hold one
+# row per location node (scanned, joins of incremental updates use automatic indexes)
+def get_indexes(table, target_column):
+    if table == 'submissions':
+        return {'location': list(REGIONS.values()) + ([target_column] if target_column is not None else []), 'key': ['KEY']}
+    return {}
+
+# Arrow table of a frame, strings are dictionary-encoded
+def to_arrow(data):
+    arrays = [pa.array(data[i], from_pandas=True) for i in data.columns]
+    arrays = [i.dictionary_encode() if pa.types.is_string(i.type) else i for i in arrays]
+    return pa.Table.from_arrays(arrays, names=list(data.columns))
+
+# write tables (frames or Arrow tables) as Arrow IPC files into a new snapshot directory, the 'linked' tables
+# are taken unchanged from the previous snapshot (hard links, copied where links are not supported)
+def write_snapshot(survey_name, tables, previous=None, linked=[]):
+    path = os.path.join(SNAPSHOT_DIR, survey_name, datetime.now().strftime('%Y%m%d%H%M%S%f'))
+    os.makedirs(path)
+    for table in linked:
+        source, target = os.path.join(previous, f'{table}.arrow'), os.path.join(path, f'{table}.arrow')
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copyfile(source, target)
+    for table, data in tables.items():
+        arrow = data if isinstance(data, pa.Table) else to_arrow(data)
+        with pa.OSFile(os.path.join(path, f'{table}.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, arrow.schema) as writer:
+                writer.write_table(arrow)
+    return path
+
+# read a table of a snapshot (memory-mapped, only the projected columns are decoded), strings are decoded as in the SQLite tables
+def read_snapshot_table(path, table, columns=None):
+    arrow = pa.ipc.open_file(pa.memory_map(os.path.join(path, f'{table}.arrow'))).read_all()
+    arrow = arrow.select(columns) if columns is not None else arrow
+    columns = [i.cast(i.type.value_type) if pa.types.is_dictionary(i.type) else i for i in arrow.columns]
+    return pa.Table.from_arrays(columns, names=arrow.column_names).to_pandas()
+
+# write a snapshot of the datalake tables, None when values cannot be typed by Arrow (e.g. mixed types in a column)
+def save_snapshot(survey_name, tables, previous=None, linked=[]):
+    with span('snapshot', rows=sum([len(i) for i in tables.values()])) as record:
+        try:
+            path = write_snapshot(survey_name, tables, previous, linked)
+        except pa.ArrowException:
+            return None
+        record['Bytes'] = sum([os.path.getsize(os.path.join(path, i)) for i in os.listdir(path)])
+    return path
+
+# register the snapshot of a survey (None: the datamart is loaded from SQLite), within the transaction of the cursor
+def register_snapshot(cursor, survey_name, path):
+    if path is not None:
+        cursor.execute('INSERT OR REPLACE INTO datalake_snapshots VALUES (?, ?)', (survey_name, path))
+    else:
+        cursor.execute('DELETE FROM datalake_snapshots WHERE "Survey Name" = ?', (survey_name,))
+    remove_snapshots(survey_name, keep=2)
+
+# write a snapshot of the datalake tables and register it, within the transaction of the cursor
+def publish_snapshot(cursor, survey_name, tables, previous=None, linked=[]):
+    register_snapshot(cursor, survey_name, save_snapshot(survey_name, tables, previous, linked))
+
+# submissions of the previous snapshot with the upserted submissions replaced (order of the survey table: upserted
+# rows last), read from the survey table when they do not fit the snapshot (new fields, types) or the row counts differ
+def upsert_snapshot_rows(conn, path, survey_name, df_new, target_column):
+    count = conn.execute(f'SELECT COUNT(*) FROM [{get_table_name("submissions", survey_name)}]').fetchone()[0]
+    try:
+        arrow = pa.ipc.open_file(pa.memory_map(os.path.join(path, 'submissions.arrow'))).read_all()
+        if ('KEY' in arrow.column_names) and all([i in arrow.column_names for i in df_new.columns]):
+            keys = arrow['KEY'].cast(pa.string())
+            kept = arrow.filter(pc.invert(pc.is_in(keys, value_set=pa.array(df_new['KEY'].astype(str).tolist(), pa.string()))))
+            new = to_arrow(df_new.reindex(columns=arrow.column_names)).cast(arrow.schema)
+            rows = pa.concat_tables([kept, new]).unify_dictionaries().combine_chunks()
+            if rows.num_rows == count:
+                return rows
+    except pa.ArrowException:
+        pass
+    return read_table(conn, 'submissions', survey_name)
+
+# remove old snapshots of a survey, the last ones are kept for datamarts being loaded
+def remove_snapshots(survey_name, keep=0):
+    folder = os.path.join(SNAPSHOT_DIR, survey_name)
+    if os.path.exists(folder):
+        for i in sorted(os.listdir(folder))[::-1][keep:]:
+            shutil.rmtree(os.path.join(folder, i), ignore_errors=True)
+
+# rows as tuples of python values (sqlite3 parameters)
+def get_records(data, columns):
+    return list(zip(*[data[i].tolist() for i in columns]))
+
+# recap tables and their region level
+RECAP_TABLES = {'rekap_prov': 'Provinsi', 'rekap_kab': 'Kabupaten_Kota', 'rekap_kec': 'Kecamatan', 'rekap_kel': 'Kelurahan', 'rekap_all': 'Kelurahan'}
+
+# apply the count deltas of changed submissions to the recap tables (affected rows only), within the transaction of
+# the cursor, returns False when the recap tables have to be rebuilt (target plan changed)
+def update_recaps(cursor, survey_name, df_new, df_old, targets, target_column):
+    conn = cursor.connection
+    state = cursor.execute('SELECT Fingerprint FROM datalake_state WHERE "Survey Name" = ?', (survey_name,)).fetchone()
+    if (state is None) or (state[0] != get_plan_fingerprint(targets, target_column)):
+        return False
+    # count deltas: new versions counted in, previous versions counted out
+    cols = ['Sample', 'Approved', 'Rejected']
+    keys = list(REGIONS.values()) + ([target_column] if target_column is not None else [])
+    removed = aggregate_submissions(df_old, target_column)
+    removed[cols] = -removed[cols]
+    delta = pd.concat([aggregate_submissions(df_new, target_column), removed]).groupby(keys)[cols].sum()
+    delta = delta[(delta != 0).any(axis=1)]
+    levels = list(REGIONS.keys())
+    for table, region in RECAP_TABLES.items():
+        name = get_table_name(table, survey_name)
+        regions = levels[:levels.index(region)+1]
+        fields = [REGIONS[i] for i in regions] + ([target_column] if target_column is not None else [])
+        names = regions + ([target_column] if target_column is not None else [])
+        rows = delta.groupby(level=fields).sum()
+        rows['Planned'] = rows.index.isin(targets.groupby(level=fields).sum().index)
+        rows = rows.reset_index().rename(columns={REGIONS[i]: i for i in regions})
+        # current values of the affected rows
+        current = read_affected(conn, table, survey_name, rows[names])
+        columns = [i for i in current.columns if i != 'row_id']
+        recap = rows.merge(current, how='left', on=names, suffixes=('_delta', ''))
+        for c in cols:
+            recap[c] = recap[c].fillna(0) + recap[f'{c}_delta']
+        # locations outside of the target plan have a target of 0
+        recap['Target'] = recap['Target'].fillna(0)
+        recap = add_features(recap)
+        if table == 'rekap_prov':
+            recap = add_percentages(recap)
+        # locations outside of the target plan without samples are removed
+        dropped = (~recap['Planned']) & (recap['Sample'] == 0)
+        existing = recap['row_id'].notna()
+        values = [i for i in columns if i not in names]
+        recap.loc[existing, 'row_id'] = recap.loc[existing, 'row_id'].astype(int)
+        cursor.executemany(f'DELETE FROM [{name}] WHERE rowid = ?', get_records(recap[dropped & existing], ['row_id']))
+        cursor.executemany(f'UPDATE [{name}] SET {", ".join([f"[{i}] = ?" for i in values])} WHERE rowid = ?',
+                           get_records(recap[~dropped & existing], values + ['row_id']))
+        insert_rows(cursor, name, recap[~dropped & ~existing][columns])
+    # count tables
+    cubes_new, cubes_old = generate_cubes(df_new, target_column), generate_cubes(df_old, target_column)
+    for table in cubes_new.keys():
+        keys = [i for i in cubes_new[table].columns if i != 'Count']
+        cubes_old[table]['Count'] = -cubes_old[table]['Count']
+        delta = pd.concat([cubes_new[table], cubes_old[table]]).groupby(keys)['Count'].sum().reset_index()
+        apply_count_deltas(cursor, get_table_name(table, survey_name), delta[delta['Count'] != 0])
+    # distinct counts of the affected kelurahan are recounted from the submissions table
+    keys = list(REGIONS.values())
+    dims = [target_column] if target_column is not None else []
+    values = list(DISTINCT_COUNTS.keys())
+    affected = pd.concat([df_new[keys], df_old[keys]]).dropna().astype(str).drop_duplicates()
+    submissions = read_affected(conn, 'submissions', survey_name, affected)
+    current = read_affected(conn, 'cube_distinct', survey_name, affected).drop(['row_id'], axis=1)
+    current[values] = -current[values]
+    counts = get_distinct_counts(submissions, target_column) if len(submissions) > 0 else None
+    delta = pd.concat([counts, current]).groupby(keys + dims)[values].sum().reset_index()
+    delta = get_nodes(delta[(delta[values] != 0).any(axis=1)], dims, values)
+    apply_count_deltas(cursor, get_table_name('cube_distinct', survey_name), delta[(delta[values] != 0).any(axis=1)], values)
+    # snapshot of the updated tables: submissions of the previous snapshot with the upserted rows replaced, recap &
+    # count tables (small) re-read, target plan unchanged (linked)
+    previous = cursor.execute('SELECT Path FROM datalake_snapshots WHERE "Survey Name" = ?', (survey_name,)).fetchone()
+    if (previous is not None) and os.path.exists(previous[0]):
+        tables = {i: read_table(conn, i, survey_name) for i in DATALAKE_TABLES if i not in ['submissions', 'metadata']}
+        tables['submissions'] = upsert_snapshot_rows(conn, previous[0], survey_name, df_new, target_column)
+        publish_snapshot(cursor, survey_name, tables, previous[0], ['metadata'])
+    # no snapshot to update (values Arrow cannot type): the datamart keeps loading from SQLite
+    else:
+        cursor.execute('DELETE FROM datalake_snapshots WHERE "Survey Name" = ?', (survey_name,))
+    # new version of the datalake (cached datamarts are reloaded)
+    cursor.execute('UPDATE datalake_state SET "Last Build" = ? WHERE "Survey Name" = ?', (datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'), survey_name))
+    return True
+
+# add count deltas to a count table, rows are keyed by all columns but the count columns: the delta is matched
+# in one join (automatic index on the keys), then rows are updated / removed (counted down to 0) by rowid or inserted
+def apply_count_deltas(cursor, table, delta, values=['Count']):
+    keys = [i for i in delta.columns if i not in values]
+    delta = delta.reset_index(drop=True)
+    cursor.execute('DROP TABLE IF EXISTS temp.delta')
+    cursor.execute(f'CREATE TEMP TABLE delta ({", ".join([f"[{i}]" for i in keys])})')
+    cursor.executemany(f'INSERT INTO temp.delta VALUES ({", ".join(["?"] * len(keys))})', get_records(delta, keys))
+    on = ' AND '.join([f't.[{i}] IS d.[{i}]' for i in keys])
+    current = pd.read_sql_query(f'SELECT d.rowid - 1 AS delta_id, t.rowid AS row_id, {", ".join([f"t.[{i}]" for i in values])} FROM temp.delta d JOIN [{table}] t ON {on}',
+                                cursor.connection).set_index('delta_id').reindex(delta.index)
+    cursor.execute('DROP TABLE temp.delta')
+    delta[values] = delta[values] + current[values].fillna(0).astype(int)
+    delta['row_id'] = current['row_id']
+    dropped = (delta[values] == 0).all(axis=1)
+    existing = delta['row_id'].notna()
+    delta.loc[existing, 'row_id'] = delta.loc[existing, 'row_id'].astype(int)
+    cursor.executemany(f'DELETE FROM [{table}] WHERE rowid = ?', get_records(delta[dropped & existing], ['row_id']))
+    cursor.executemany(f'UPDATE [{table}] SET {", ".join([f"[{i}] = ?" for i in values])} WHERE rowid = ?', get_records(delta[~dropped & existing], values + ['row_id']))
+    insert_rows(cursor, table, delta[~dropped & ~existing][keys + values])
 
 # delete selected rows from 'survey_name' table
 def delete_rows_surveys(surveys_df, selected_rows):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # remove survey_name from 'list_surveys' table
-    for name in surveys_df[selected_rows]['Survey Name']:
-        # Execute the DELETE statement
-        delete_sql = f'DELETE FROM list_surveys WHERE "Survey Name" = ?'
-        cursor.execute(delete_sql, (name,))
-        # drop the corresponding tables
-        for table_name in [name, f'{name}_rekap_all', f'{name}_rekap_prov', f'{name}_rekap_kab', f'{name}_rekap_kec', f'{name}_rekap_kel']:
-            sql_drop_table = f"DROP TABLE IF EXISTS {table_name};"
-            cursor.execute(sql_drop_table)
-    # commit the changes & close the connection
-    conn.commit()
-    conn.close()
-
-# generate datamart
+    with get_writer() as conn:
+        cursor = conn.cursor()
+        # remove survey_name from 'list_surveys' table
+        for name in surveys_df[selected_rows]['Survey Name']:
+            # Execute the DELETE statement
+            delete_sql = f'DELETE FROM list_surveys WHERE "Survey Name" = ?'
+            cursor.execute(delete_sql, (name,))
+            cursor.execute('DELETE FROM datalake_state WHERE "Survey Name" = ?', (name,))
+            cursor.execute('DELETE FROM datalake_snapshots WHERE "Survey Name" = ?', (name,))
+            cursor.execute('DELETE FROM metrics WHERE "Survey Name" = ?', (name,))
+            remove_snapshots(name)
+            # drop the survey tables
+            for table_name in [get_table_name(i, name) for i in DATALAKE_TABLES]:
+                sql_drop_table = f"DROP TABLE IF EXISTS [{table_name}];"
+                cursor.execute(sql_drop_table)
+
+# share of distinct values below which string columns are held as categoricals in the datamart
+CATEGORY_RATIO = float(os.getenv('CATEGORY_RATIO', 0.5))
+
+# compact dtypes: categoricals for repeated strings (locations, enumerators, status, answers), smallest integer types for counts & targets
+def optimize_dtypes(data):
+    for i in data.columns:
+        if data[i].dtype == 'object':
+            if data[i].nunique() <= CATEGORY_RATIO * len(data):
+                data[i] = data[i].astype('category')
+        elif pd.api.types.is_integer_dtype(data[i]):
+            data[i] = pd.to_numeric(data[i], downcast='integer')
+    return data
+
+# memory of a table (bytes), strings included
+def get_memory_usage(data):
+    return int(data.memory_usage(index=True, deep=True).sum())
+
+# datamart attributes & their datalake tables (loaded on first access), count tables indexed by location node
+TABLE_ATTRIBUTES = {'df': 'submissions', 'metadata': 'metadata', 'df_rekap_all': 'rekap_all', 'df_rekap_prov': 'rekap_prov', 'df_rekap_kab': 'rekap_kab',
+                    'df_rekap_kec': 'rekap_kec', 'df_rekap_kel': 'rekap_kel', 'cube': 'cube', 'cube_enum': 'cube_enum', 'distinct': 'cube_distinct'}
+NODE_TABLES = ['cube', 'cube_distinct']
+
+# location hierarchy of a survey (PROV -> KAB -> KEC -> KEL): sorted children of each location node, for all
+# categories (None) & for each category where the locations are planned, nodes are full paths (same names don't collide)
+class location_index():
+
+    def __init__(self, data, target_column=None):
+        regions = list(REGIONS.keys())
+        data = data.drop_duplicates()
+        groups = [(None, data)]
+        if target_column is not None:
+            groups += list(data.groupby(target_column, observed=True))
+        self.children = {}
+        for category, group in groups:
+            for n in range(1, len(regions) + 1):
+                for node in group[regions[:n]].drop_duplicates().itertuples(index=False, name=None):
+                    self.children.setdefault((category, node[:-1]), []).append(node[-1])
+        for v in self.children.values():
+            v.sort()
+
+    # children of a location node (tuple of names from provinsi), none below 'ALL'
+    def get_children(self, node=(), category=None):
+        return self.children.get((category, tuple(node)), [])
+
+    # memory of the index (dict, node keys, lists of children & their names, bytes)
+    def get_memory_usage(self):
+        size = sys.getsizeof(self.children)
+        for key, children in self.children.items():
+            size += sys.getsizeof(key) + sys.getsizeof(key[1]) + sys.getsizeof(children) + sum([sys.getsizeof(i) for i in children])
+        return size
+
+# datamart of a session: copy of the cached datamart (tables are shared read-only, computed numbers belong to the session)
 def generate_datamart(nama_survei):
-    dm = datamart(DB_PATH, nama_survei)
-    dm.load_all_tables()
-    return dm
+    return copy.copy(datamarts.get(nama_survei))
 
 # load provinsi geojson
 @st.cache_data
@@ -359,17 +1061,9 @@ def title_h1(nama_survei):
     title = f"Rekapitulasi Data QC <span style='color:  #aeb6bf'>{nama_survei}</span>" 
     st.markdown(f"<h1 style='text-align: center; color: black; font-size:32px;'>{title}</h1>", unsafe_allow_html=True)
 
-# construct links
-def get_link(region, df, nama_survei, selected_category):
-    if region == 'Provinsi':
-        links = df.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Provinsi}</a>' if x[region]!='TIDAK DIKENALI' else x[region], axis=1)
-    elif region == 'Kabupaten_Kota':
-        links = df.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kabupaten={x.Kabupaten_Kota}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kabupaten_Kota}</a>' if x[region]!='TIDAK DIKENALI' else x[region], axis=1)
-    elif region == 'Kecamatan':
-        links = df.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kabupaten={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kecamatan}</a>' if x[region]!='TIDAK DIKENALI' else x[region], axis=1)
-    elif region == 'Kelurahan':
-        links = df.apply(lambda x : f'<a href="{DASHBOARD_HOST}/Local_Data?selected_provinsi={x.Provinsi}&selected_kabupaten={x.Kabupaten_Kota}&selected_kecamatan={x.Kecamatan}&selected_kelurahan={x.Kelurahan}&nama_survei={nama_survei}&selected_category={selected_category}" target="_blank">{x.Kelurahan}</a>' if x[region]!='TIDAK DIKENALI' else x[region], axis=1)
-    return links
+# grid context, used by the JS renderers to build the links in the browser
+def get_grid_context(nama_survei, selected_category):
+    return {'server_name': SERVER_NAME, 'dashboard_host': DASHBOARD_HOST, 'nama_survei': nama_survei, 'selected_category': selected_category}
 
 # download dataframe
 def download_dataframe_as_excel(df):
@@ -392,6 +1086,82 @@ def draw_logo(divider=None):
         st.sidebar.markdown("---")
     st.sidebar.image(image_path, use_column_width=True)
 
+# ----------------------------------------------------------------------------------------------------------------------------
+# SURVEYCTO CLIENT
+
+class scto_client(SurveyCTOObject):
+
+    def __init__(self, server_name, username, password):
+        super().__init__(server_name, username, password)
+        # keep-alive connection pool with exponential backoff on throttling & server errors
+        retry = Retry(total=SCTO_MAX_RETRIES, backoff_factor=SCTO_BACKOFF_FACTOR, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['HEAD', 'GET', 'POST', 'DELETE'], respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=SCTO_POOL_SIZE, pool_maxsize=SCTO_POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = (SCTO_CONNECT_TIMEOUT, SCTO_READ_TIMEOUT)
+        self.base_url = SCTO_BASE_URL
+        # request metrics
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    # fetch data from a SurveyCTO url through the shared session
+    def get_url_data(self, url, line_breaks=None, key=False):
+        if self.base_url is not None:
+            url = url.replace(f'https://{self.server_name}.surveycto.com', self.base_url.rstrip('/'))
+        # csv line break setting is stored on the server, only touched when requested
+        if line_breaks is not None:
+            return super().get_url_data(url, line_breaks, key=key)
+        # basic authentication first, digest authentication for old SurveyCTO versions
+        for auth in [self.auth_basic, self.auth_digest]:
+            start = time.perf_counter()
+            if key is False:
+                response = self.session.get(url, headers=self.default_headers, auth=auth, timeout=self.timeout)
+            else:
+                response = self.session.post(url, files={'private_key': key}, headers=self.default_headers, auth=auth, timeout=self.timeout)
+            self.add_metric(url, response, time.perf_counter() - start)
+            add_span_bytes(len(response.content))
+            if response.status_code != 401:
+                break
+        response.raise_for_status()
+        return response
+
+    # submissions completed after a date, in the given review statuses (API v2, json): pysurveycto drops the review
+    # statuses when a date is given and the server default applies
+    def get_form_data_since(self, form_id, oldest_completion_date, review_status):
+        date = quote(oldest_completion_date.strftime('%b %-d, %Y %-I:%M:%S %p'))
+        url = f'https://{self.server_name}.surveycto.com/api/v2/forms/data/wide/json/{form_id}?date={date}&r={"|".join(review_status)}'
+        return self.get_url_data(url).json()
+
+    # record request latency & bytes transferred
+    def add_metric(self, url, response, seconds):
+        with self.lock:
+            self.metrics.append({'url': url.split('?')[0], 'status': response.status_code, 'seconds': seconds, 'bytes': len(response.content)})
+
+    # summary of the recorded requests, metrics are reset
+    def pop_metrics(self):
+        with self.lock:
+            metrics, self.metrics = self.metrics, []
+        return {
+            'requests': len(metrics),
+            'errors': len([i for i in metrics if i['status'] >= 400]),
+            'seconds': sum([i['seconds'] for i in metrics]),
+            'max_seconds': max([i['seconds'] for i in metrics], default=0),
+            'bytes': sum([i['bytes'] for i in metrics])
+        }
+
+_scto = None
+_scto_lock = threading.Lock()
+
+# shared SurveyCTO client (one connection pool per process)
+def get_scto_client():
+    global _scto
+    with _scto_lock:
+        if _scto is None:
+            _scto = scto_client(SERVER_NAME, SCTO_USERNAME, SCTO_PASSWORD)
+    return _scto
+
 # ----------------------------------------------------------------------------------------------------------------------------
 # DATAMART CLASS
 
@@ -400,62 +1170,120 @@ class datamart():
     def __init__(self, DB_PATH, nama_survei):
         self.DB_PATH = DB_PATH
         self.nama_survei = nama_survei
+        # pinned version of the datalake (build time, snapshot, survey parameters, run), shared by the session copies
+        self.pinned = {'version': None, 'snapshot': None, 'list_surveys': None, 'target_column': None, 'run': None}
+        # loaded tables & projections, shared by the session copies of a cached datamart
+        self.tables = {}
+        # indexes built from the loaded tables, shared as well
+        self.indexes = {}
+        self.lock = threading.RLock()
+        # memory of the loaded tables before & after dtype optimization (bytes)
+        self.memory = {}
+        # called after each table load (memory budget of the cache holding the datamart)
+        self.on_load = None
+
+    version = property(lambda self: self.pinned['version'])
+    snapshot = property(lambda self: self.pinned['snapshot'])
+    list_surveys = property(lambda self: self.pinned['list_surveys'])
+    target_column = property(lambda self: self.pinned['target_column'])
+    run = property(lambda self: self.pinned['run'])
+
+    # tables are loaded on first access
+    def __getattr__(self, name):
+        if name in TABLE_ATTRIBUTES:
+            return self.get_table(TABLE_ATTRIBUTES[name])
+        raise AttributeError(name)
 
-    # load table
-    def load_table(self, table):
-        conn = sqlite3.connect(self.DB_PATH)
-        df = pd.read_sql_query(f'SELECT * FROM {table}', conn)
-        conn.close()
-        return df
+    # pin the published version: build time & snapshot (tables loaded later are read from it), survey parameters
+    def open(self):
+        with read_snapshot(self.DB_PATH) as conn:
+            version = get_datalake_version(self.nama_survei, conn)
+            snapshot = conn.execute('SELECT Path FROM datalake_snapshots WHERE "Survey Name" = ?', (self.nama_survei,)).fetchone()
+            list_surveys = pd.read_sql_query('SELECT * FROM list_surveys WHERE "Survey Name" = ?', conn, params=(self.nama_survei,))
+        # lazy loads of the datamart are timed as one run
+        self.pinned.update({'version': version, 'snapshot': snapshot[0] if snapshot is not None else None, 'list_surveys': list_surveys,
+                            'target_column': list_surveys['Target Column'].values[0], 'run': get_run_id()})
 
-    # load all tables
+    # a newer version was published since the datamart was opened: the loaded tables are dropped & the new version
+    # pinned (once, when the datamart is still pinned to the stale version)
+    def reload(self, stale=None):
+        with self.lock:
+            if (stale is not None) and (self.version != stale):
+                return
+            self.tables.clear()
+            self.indexes.clear()
+            self.memory.clear()
+            self.open()
+
+    # table of the survey, all columns or a projection (served from the whole table if loaded), loaded once
+    def get_table(self, table, columns=None):
+        with self.lock:
+            if (columns is not None) and (table in self.tables):
+                return self.tables[table][columns]
+            key = table if columns is None else f'{table}[{", ".join(columns)}]'
+            if key not in self.tables:
+                with trace(self.nama_survei, self.run):
+                    self.tables[key] = self.load_table(table, columns)
+            return self.tables[key]
+
+    # load the rows of the survey in a datalake table (columnar snapshot if available), with compact dtypes
+    def load_table(self, table, columns=None):
+        name = table if columns is None else f'{table}[{", ".join(columns)}]'
+        with span('datamart load'), span(f'load {name}') as record:
+            data = self.read_pinned(table, columns)
+            before = get_memory_usage(data)
+            data = optimize_dtypes(data)
+            # count tables are indexed by location node
+            if (table in NODE_TABLES) and (columns is None):
+                data = data.set_index(list(REGIONS.values())).sort_index()
+            self.memory[name] = (before, get_memory_usage(data))
+            record['Rows'], record['Bytes'] = len(data), self.memory[name][1]
+        if self.on_load is not None:
+            self.on_load(self)
+        return data
+
+    # rows of the pinned version: from the snapshot, or from SQLite in one read transaction checking the version
+    # (filtered reads, no snapshot published, or removed by newer builds), the datamart is reloaded when the version changed
+    def read_pinned(self, table, columns=None, where=None, params=()):
+        while True:
+            pinned = self.pinned.copy()
+            if (where is None) and (pinned['snapshot'] is not None) and os.path.exists(os.path.join(pinned['snapshot'], f'{table}.arrow')):
+                return read_snapshot_table(pinned['snapshot'], table, columns)
+            with read_snapshot(self.DB_PATH) as conn:
+                if get_datalake_version(self.nama_survei, conn) == pinned['version']:
+                    return read_table(conn, table, self.nama_survei, where if where is not None else '1', params, columns)
+            self.reload(pinned['version'])
+
+    # load all tables at once (rows & memory of each table are recorded by the load spans)
     def load_all_tables(self):
-        self.list_surveys = self.load_table('list_surveys')
-        self.list_surveys = self.list_surveys[self.list_surveys['Survey Name']==self.nama_survei]
-        self.df = self.load_table(self.nama_survei)
-        self.metadata = self.load_table(table=f'{self.nama_survei}_metadata')
-        self.df_rekap_all = self.load_table(table=f'{self.nama_survei}_rekap_all')
-        self.df_rekap_prov = self.load_table(table=f'{self.nama_survei}_rekap_prov')
-        self.df_rekap_kab = self.load_table(table=f'{self.nama_survei}_rekap_kab')
-        self.df_rekap_kec = self.load_table(table=f'{self.nama_survei}_rekap_kec')
-        self.df_rekap_kel = self.load_table(table=f'{self.nama_survei}_rekap_kel')
-
-    # get total numbers of people
-    def get_total_number(self, location_filter, metadata_filter, target_column, selected_category):
-        if location_filter is not None:
-            if target_column is not None:
-                filter_ = (self.df[target_column]==selected_category) & location_filter
-                approved = len(self.df[(self.df['review_status']=='APPROVED') & (self.df[target_column]==selected_category) & filter_])
-            else:
-                filter_ = location_filter
-                approved = len(self.df[(self.df['review_status']=='APPROVED') & filter_])
-        else:
-            if target_column is not None:
-                filter_ = self.df[target_column]==selected_category
-                approved = len(self.df[(self.df['review_status']=='APPROVED') & (self.df[target_column]==selected_category)])
-            else:
-                filter_ = pd.Series([True] * len(self.df))
-                approved = len(self.df[self.df['review_status']=='APPROVED'])
-        # target
+        self.open()
+        for table in TABLE_ATTRIBUTES.values():
+            self.get_table(table)
+
+    # submissions of the pinned version by KEY (table order)
+    def query_keys(self, keys):
+        return self.read_pinned('submissions', where='t.KEY IN (SELECT value FROM json_each(?))', params=[json.dumps(list(keys))])
+
+    # get total numbers of people (status cube & distinct counts)
+    def get_total_number(self, location, target_column, selected_category):
+        status = self.get_cube_node(self.cube, location)
+        distinct = self.get_cube_node(self.distinct, location)
         if target_column is not None:
-            if metadata_filter is not None:
-                self.n_target = self.metadata[metadata_filter][selected_category].sum()
-            else:
-                self.n_target = self.metadata[selected_category].sum()
-        else:
-            if metadata_filter is not None:
-                self.n_target = self.metadata[metadata_filter]['JML'].sum()
-            else:
-                self.n_target = self.metadata['JML'].sum()
+            status = status[status[target_column]==selected_category]
+            distinct = distinct[distinct[target_column]==selected_category]
+        approved = int(status[status['review_status']=='APPROVED']['Count'].sum())
+        # target
+        column = selected_category if target_column is not None else 'JML'
+        metadata = self.get_table('metadata', [column]) if location is None else self.query_table('metadata', location)
+        self.n_target = metadata[column].sum()
         # deficit
         self.delta_n_target = approved - self.n_target
         self.delta_n_target = '.' if self.delta_n_target==0 else '+'+str(self.delta_n_target) if self.delta_n_target>0 else str(self.delta_n_target)
         # others
-        self.n_data = len(self.df[filter_])
-        cols = ['PROV', 'KOTA_KAB', 'KEC', 'KEL']
-        self.n_resp = len(self.df[filter_].groupby(cols+['NAMA_KK', 'NAMA_RESPONDEN']).size().values)
-        self.n_enum = len(self.df[filter_].groupby(cols+['NAMA_ENUM']).size().values)
-        self.n_kk = len(self.df[filter_].groupby(cols+['NAMA_KK']).size().values)
+        self.n_data = int(status['Count'].sum())
+        self.n_resp = int(distinct['Responden'].sum())
+        self.n_enum = int(distinct['Enumerator'].sum())
+        self.n_kk = int(distinct['KK'].sum())
 
     @staticmethod
     # organize string for delta_n
@@ -483,51 +1311,159 @@ class datamart():
         self.n_kec = len(list_kec)
         self.n_kel = len(list_kel)
         # difference
-        self.delta_n_prov = -len([i for i in self.df_rekap_prov[self.df_rekap_prov['Deficit']>0]['Provinsi'] if i in list_prov])
+        self.delta_n_prov = -len([i for i in self.get_table('rekap_prov', ['Provinsi', 'Deficit']).query('Deficit > 0')['Provinsi'] if i in list_prov])
         self.delta_n_prov = self.text_out(self.delta_n_prov)
-        self.delta_n_kab = -len([i for i in self.df_rekap_kab[self.df_rekap_kab['Deficit']>0]['Kabupaten_Kota'] if i in list_kab])
+        self.delta_n_kab = -len([i for i in self.get_table('rekap_kab', ['Kabupaten_Kota', 'Deficit']).query('Deficit > 0')['Kabupaten_Kota'] if i in list_kab])
         self.delta_n_kab = self.text_out(self.delta_n_kab)
-        self.delta_n_kec = -len([i for i in self.df_rekap_kec[self.df_rekap_kec['Deficit']>0]['Kecamatan'] if i in list_kec])
+        self.delta_n_kec = -len([i for i in self.get_table('rekap_kec', ['Kecamatan', 'Deficit']).query('Deficit > 0')['Kecamatan'] if i in list_kec])
         self.delta_n_kec = self.text_out(self.delta_n_kec)
-        self.delta_n_kel = -len([i for i in self.df_rekap_kel[self.df_rekap_kel['Deficit']>0]['Kelurahan'] if i in list_kel])
+        self.delta_n_kel = -len([i for i in self.get_table('rekap_kel', ['Kelurahan', 'Deficit']).query('Deficit > 0')['Kelurahan'] if i in list_kel])
         self.delta_n_kel = self.text_out(self.delta_n_kel)
 
-    #  get list of locations
+    # location hierarchy of the published version, built once (its memory is accounted with the loaded tables)
+    def get_location_index(self):
+        with self.lock:
+            if 'location' in self.indexes:
+                return self.indexes['location']
+            columns = list(REGIONS.keys()) + ([self.target_column] if self.target_column is not None else [])
+            index = location_index(self.read_pinned('rekap_all', columns), self.target_column)
+            size = index.get_memory_usage()
+            self.indexes['location'] = index
+            self.memory['location index'] = (size, size)
+        if self.on_load is not None:
+            self.on_load(self)
+        return index
+
+    #  get list of locations (same projections as the location counts)
     def get_list_location(self):
-        self.list_provinsi = sorted(self.df_rekap_prov['Provinsi'].unique().tolist())
-        self.list_kab_kota = sorted(self.df_rekap_kab['Kabupaten_Kota'].unique().tolist())
-        self.list_kecamatan = sorted(self.df_rekap_kec['Kecamatan'].unique().tolist())
-        self.list_kelurahan = sorted(self.df_rekap_kel['Kelurahan'].unique().tolist())
+        self.list_provinsi = sorted(self.get_table('rekap_prov', ['Provinsi', 'Deficit'])['Provinsi'].unique().tolist())
+        self.list_kab_kota = sorted(self.get_table('rekap_kab', ['Kabupaten_Kota', 'Deficit'])['Kabupaten_Kota'].unique().tolist())
+        self.list_kecamatan = sorted(self.get_table('rekap_kec', ['Kecamatan', 'Deficit'])['Kecamatan'].unique().tolist())
+        self.list_kelurahan = sorted(self.get_table('rekap_kel', ['Kelurahan', 'Deficit'])['Kelurahan'].unique().tolist())
+
+    @staticmethod
+    # location node of a selection (provinsi, kabupaten/kota, kecamatan, kelurahan), all locations below 'ALL' or None
+    def get_node(location):
+        node, below = [], False
+        for i in (location if location is not None else [None] * len(REGIONS)):
+            below = below or (i is None) or (i == 'ALL')
+            node.append('ALL' if below else i)
+        return tuple(node)
+
+    # rows of the pinned version of a datalake table, in a location node & category (filters are pushed down to SQLite, table order is kept)
+    def query_table(self, table, location, fields=list(REGIONS.values()), target_column=None, selected_category=None):
+        filters = [(f, v) for f, v in zip(fields, self.get_node(location)) if v != 'ALL']
+        if target_column is not None:
+            filters.append((target_column, selected_category))
+        where = ' AND '.join([f't.[{f}] = ?' for f, _ in filters]) if len(filters) > 0 else '1'
+        return self.read_pinned(table, where=where, params=[v for _, v in filters])
+
+    # rows of a location node in a count table (status cube, distinct counts)
+    def get_cube_node(self, cube, location):
+        node = self.get_node(location)
+        if node in cube.index:
+            return cube.loc[[node]]
+        return cube.iloc[0:0]
 
     # get status aggregate
-    def get_agg_status(self, location_filter, target_column, selected_category):
-        if location_filter is not None:
-            if target_column is not None:
-                filter_ = (self.df[target_column]==selected_category) & location_filter
-            else:
-                filter_ = pd.Series([True] * len(self.df)) & location_filter
-        else:
-            if target_column is not None:
-                filter_ = self.df[target_column]==selected_category
-            else:
-                filter_ = pd.Series([True] * len(self.df))            
-        agg = self.df[filter_].groupby('review_status').size().reset_index()
+    def get_agg_status(self, location, target_column, selected_category):
+        data = self.get_cube_node(self.cube, location)
+        if target_column is not None:
+            data = data[data[target_column]==selected_category]
+        agg = data.groupby('review_status', observed=True)['Count'].sum().reset_index()
         agg.columns = ['Status', 'Count']
         self.agg_status = agg.sort_values('Count')
 
     # get quality aggregate
-    def get_agg_target(self, data, target_column):
-        agg = data.groupby([target_column, 'review_status']).size().reset_index()
+    def get_agg_target(self, location, target_column):
+        data = self.get_cube_node(self.cube, location)
+        agg = data.groupby([target_column, 'review_status'], observed=True)['Count'].sum().reset_index()
         agg.columns = ['Target', 'Status', 'Count']
         agg = agg.sort_values(['Count','Status'], ascending=False)
         return agg.sort_values('Count')
 
+    # get rejected submissions per enumerator
+    def get_rejected_enumerators(self):
+        cols = ['PROV', 'KOTA_KAB', 'KEC', 'KEL', 'NAMA_ENUM']
+        data = self.cube_enum[self.cube_enum['review_status']=='REJECTED'].sort_values(['Count', 'NAMA_ENUM'], ascending=False)
+        data = data[cols + ['Count']]
+        data.columns = cols + ['Rejected Count']
+        return data
+
+# version of the published datalake of a survey (build time, updated on every publish)
+def get_datalake_version(survey_name, conn=None):
+    row = (conn if conn is not None else get_reader()).execute('SELECT "Last Build" FROM datalake_state WHERE "Survey Name" = ?', (survey_name,)).fetchone()
+    return row[0] if row is not None else None
+
+# memory of the loaded tables of a datamart (bytes)
+def get_datamart_memory(dm):
+    return sum([i[1] for i in list(dm.memory.values())])
+
+# process-wide cache of loaded datamarts shared by all sessions, keyed by survey & datalake version,
+# least recently used datamarts are evicted over the memory budget
+class datamart_cache():
+
+    def __init__(self, budget_mb):
+        self.budget = budget_mb * 1e6
+        # survey name: datamart (pinned version)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}
+
+    # datamart of the published version, loaded once for all sessions
+    def get(self, survey_name):
+        version = get_datalake_version(survey_name)
+        with self.lock:
+            loading = self.loading.setdefault(survey_name, threading.Lock())
+        # sessions asking for a survey being loaded wait for it
+        with loading:
+            with self.lock:
+                dm = self.entries.get(survey_name)
+                if (dm is not None) and (dm.version == version):
+                    self.entries.move_to_end(survey_name)
+                    return dm
+            dm = datamart(DB_PATH, survey_name)
+            dm.open()
+            dm.on_load = self.touch
+            with self.lock:
+                self.entries[survey_name] = dm
+                self.entries.move_to_end(survey_name)
+                self.evict()
+        return dm
+
+    # a table was loaded by a datamart: it becomes the most recently used, datamarts over the budget are evicted
+    # (the datamart locks are not taken, the datamart may be loading)
+    def touch(self, dm):
+        with self.lock:
+            if self.entries.get(dm.nama_survei) is dm:
+                self.entries.move_to_end(dm.nama_survei)
+            self.evict()
+
+    # least recently used datamarts over the memory budget (tables are loaded lazily, sizes grow after insertion)
+    def evict(self):
+        while (len(self.entries) > 1) and (sum([get_datamart_memory(i) for i in self.entries.values()]) > self.budget):
+            self.entries.popitem(last=False)
+
+    # cached surveys, versions & memory (MB)
+    def get_usage(self):
+        with self.lock:
+            self.evict()
+            return [(k, v.version, get_datamart_memory(v) / 1e6) for k, v in self.entries.items()]
+
+    # memory of the loaded tables of cached datamarts (MB), as read & after dtype optimisation
+    def get_table_usage(self):
+        with self.lock:
+            return [(k, name, raw / 1e6, optimised / 1e6) for k, v in self.entries.items() for name, (raw, optimised) in list(v.memory.items())]
+
 # ----------------------------------------------------------------------------------------------------------------------------
 # SETUP
 
-# Create empty 'list_surveys' table
+# Create empty 'list_surveys', 'datalake_state', 'datalake_snapshots' & 'metrics' tables
 create_empty_table()
 
+# Datamarts shared by the sessions of the process
+datamarts = datamart_cache(DATAMART_CACHE_MB)
+
 # ----------------------------------------------------------------------------------------------------------------------------
 # Load static data
 
@@ -598,35 +1534,38 @@ function(params) {
 };
 """)
 
-# Define JS function for rendering the links in Provinsi column (Global Data Table)
-cell_renderer_prov = JsCode("""
-function(params) {
-    return params.data.Provinsi
-}
+# Define JS function for rendering the links to Local Data page in region columns (URL parameters from grid context & row data)
+def get_region_renderer(region):
+    url_params = {'Provinsi': 'selected_provinsi', 'Kabupaten_Kota': 'selected_kab_kota', 'Kecamatan': 'selected_kecamatan', 'Kelurahan': 'selected_kelurahan'}
+    regions = list(url_params.keys())
+    query = " + '&".join([f"{url_params[r]}=' + encodeURIComponent(params.data.{r})" for r in regions[:regions.index(region)+1]])
+    return JsCode(f"""
+function(params) {{
+    if (params.data.{region} == 'TIDAK DIKENALI') {{
+        return params.data.{region};
+    }}
+    var url = params.context.dashboard_host + '/Local_Data?{query} + '&nama_survei=' + encodeURIComponent(params.context.nama_survei);
+    if (params.context.selected_category != null) {{
+        url += '&selected_category=' + encodeURIComponent(params.context.selected_category);
+    }}
+    return '<a href="' + url + '" target="_blank">' + params.data.{region} + '</a>';
+}}
 """)
+
+# Define JS function for rendering the links in Provinsi column (Global Data Table)
+cell_renderer_prov = get_region_renderer('Provinsi')
 # Define JS function for rendering the links in Kabupaten_Kota column (Global Data Table)
-cell_renderer_kab = JsCode("""
-function(params) {
-    return params.data.Kabupaten_Kota
-}
-""")
+cell_renderer_kab = get_region_renderer('Kabupaten_Kota')
 # Define JS function for rendering the links in Kecamatan column (Global Data Table)
-cell_renderer_kec = JsCode("""
-function(params) {
-    return params.data.Kecamatan
-}
-""")
+cell_renderer_kec = get_region_renderer('Kecamatan')
 # Define JS function for rendering the links in Kelurahan column (Global Data Table)
-cell_renderer_kel = JsCode("""
-function(params) {
-    return params.data.Kelurahan
-}
-""")
+cell_renderer_kel = get_region_renderer('Kelurahan')
 
-# Define JS function for rendering the links in 'Link' column
+# Define JS function for rendering the links to SurveyCTO server in 'Link' column (built from KEY)
 cell_link = JsCode("""
 function(params) {
-    return params.data.Link
+    var uuid = params.data.KEY.split('uuid:').pop();
+    return '<a href="https://' + params.context.server_name + '.surveycto.com/view/submission.html?uuid=uuid%3A' + uuid + '" target="_blank">link</a>';
 }
 """)
 
@@ -101,11 +101,9 @@ if st.session_state.authentication_status:
     nama_survei = st.sidebar.selectbox('Nama Survei', list_survei, index=idx)
     url_params.update({'nama_survei': nama_survei})
 
-    # Remove 'dm' state if nama_survei changes
+    # Reset states if nama_survei changes
     if 'nama_survei' in st.session_state:
         if nama_survei != st.session_state.nama_survei:
-            dm = generate_datamart(nama_survei)
-            st.session_state.dm = dm
             st.session_state.nama_survei = nama_survei
             target_column = target_columns[nama_survei]
             if target_column is None:
@@ -114,18 +112,16 @@ if st.session_state.authentication_status:
     # ----------------------------------------------------------------------------------------------------------------------------
     # Data Mart
 
-    if 'dm' not in st.session_state:
-        dm = generate_datamart(nama_survei)
-        st.session_state.dm = dm
-    else:
-        dm = st.session_state.dm
+    # shared datamart of the published version (reloaded once per process when the survey is republished)
+    dm = generate_datamart(nama_survei)
+    st.session_state.dm = dm
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Target Categories
 
     target_column = target_columns[nama_survei]
     if target_column is not None:
-        target_categories = dm.df[target_column].unique().tolist()
+        target_categories = dm.cube[target_column].unique().tolist()
         target_categories.sort()
         if param_category is not None:
             selected_category = st.sidebar.selectbox('Target Category', target_categories, index=target_categories.index(param_category))
@@ -140,29 +136,26 @@ if st.session_state.authentication_status:
     # ----------------------------------------------------------------------------------------------------------------------------
     # Category Filter
 
-    if target_column is not None:
-        filter_ = dm.df_rekap_prov[target_column] == selected_category
-    else:
-        filter_ = pd.Series([True] * len(dm.df_rekap_prov))
-
-    dm.get_list_location()
+    # locations planned for the selected category (children of each location node)
+    locations = dm.get_location_index()
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Define Filters
 
     # provinsi
-    if param_provinsi is not None:
-        selected_provinsi = st.sidebar.selectbox('Provinsi', dm.list_provinsi, index=dm.list_provinsi.index(param_provinsi))
+    list_provinsi = locations.get_children((), selected_category)
+    if param_provinsi in list_provinsi:
+        selected_provinsi = st.sidebar.selectbox('Provinsi', list_provinsi, index=list_provinsi.index(param_provinsi))
     else:
-        selected_provinsi = st.sidebar.selectbox('Provinsi', dm.list_provinsi)
+        selected_provinsi = st.sidebar.selectbox('Provinsi', list_provinsi)
     if selected_provinsi != param_provinsi:
         st.session_state.change_selected_provinsi = True 
     st.session_state.selected_provinsi = selected_provinsi
     url_params.update({'selected_provinsi': selected_provinsi})    
 
     # kab/kota
-    list_kabkota_prov = [i for i in dm.list_kab_kota if i in dm.df_rekap_all[dm.df_rekap_all['Provinsi']==selected_provinsi]['Kabupaten_Kota'].tolist()] + ['ALL']
-    if (param_kab_kota is not None) & ('change_selected_provinsi' not in st.session_state):
+    list_kabkota_prov = locations.get_children((selected_provinsi,), selected_category) + ['ALL']
+    if (param_kab_kota in list_kabkota_prov) & ('change_selected_provinsi' not in st.session_state):
         selected_kab_kota = st.sidebar.selectbox('Kabupaten/Kota', list_kabkota_prov, index=list_kabkota_prov.index(param_kab_kota))
     else:
         selected_kab_kota = st.sidebar.selectbox('Kabupaten/Kota', list_kabkota_prov, index=list_kabkota_prov.index('ALL'))
@@ -172,8 +165,8 @@ if st.session_state.authentication_status:
     url_params.update({'selected_kab_kota': selected_kab_kota}) 
 
     # kecamatan
-    list_kec_kabkota = [i for i in dm.list_kecamatan if i in dm.df_rekap_all[dm.df_rekap_all['Kabupaten_Kota']==selected_kab_kota]['Kecamatan'].tolist()] + ['ALL']
-    if (param_kecamatan is not None) & ('change_selected_kab_kota' not in st.session_state):
+    list_kec_kabkota = locations.get_children((selected_provinsi, selected_kab_kota), selected_category) + ['ALL']
+    if (param_kecamatan in list_kec_kabkota) & ('change_selected_kab_kota' not in st.session_state):
         selected_kecamatan = st.sidebar.selectbox('Kecamatan', list_kec_kabkota, index=list_kec_kabkota.index(param_kecamatan))
     else:
         selected_kecamatan = st.sidebar.selectbox('Kecamatan', list_kec_kabkota, index=list_kec_kabkota.index('ALL'))
@@ -183,8 +176,8 @@ if st.session_state.authentication_status:
     url_params.update({'selected_kecamatan': selected_kecamatan})
 
     # kelurahan
-    list_kel_kec = [i for i in dm.list_kelurahan if i in dm.df_rekap_all[dm.df_rekap_all['Kecamatan']==selected_kecamatan]['Kelurahan'].tolist()] + ['ALL']
-    if (param_kelurahan is not None) & ('change_selected_kecamatan' not in st.session_state):
+    list_kel_kec = locations.get_children((selected_provinsi, selected_kab_kota, selected_kecamatan), selected_category) + ['ALL']
+    if (param_kelurahan in list_kel_kec) & ('change_selected_kecamatan' not in st.session_state):
         selected_kelurahan = st.sidebar.selectbox('Kelurahan', list_kel_kec, index=list_kel_kec.index(param_kelurahan))
     else:
         selected_kelurahan = st.sidebar.selectbox('Kelurahan', list_kel_kec, index=list_kel_kec.index('ALL'))        
@@ -194,28 +187,14 @@ if st.session_state.authentication_status:
     # ----------------------------------------------------------------------------------------------------------------------------
     # Get Selections
 
-    if selected_kab_kota == 'ALL':
-        selection1 = (dm.df['PROV']==selected_provinsi)
-        selection2 = (dm.df_rekap_all['Provinsi']==selected_provinsi)
-        selection3 = (dm.metadata['PROV']==selected_provinsi)
-    elif selected_kecamatan == 'ALL':
-        selection1 = (dm.df['PROV']==selected_provinsi) & (dm.df['KOTA_KAB']==selected_kab_kota)
-        selection2 = (dm.df_rekap_all['Provinsi']==selected_provinsi) & (dm.df_rekap_all['Kabupaten_Kota']==selected_kab_kota)
-        selection3 = (dm.metadata['PROV']==selected_provinsi) & (dm.metadata['KOTA_KAB']==selected_kab_kota)
-    elif selected_kelurahan == 'ALL':
-        selection1 = (dm.df['PROV']==selected_provinsi) & (dm.df['KOTA_KAB']==selected_kab_kota) & (dm.df['KEC']==selected_kecamatan)
-        selection2 = (dm.df_rekap_all['Provinsi']==selected_provinsi) & (dm.df_rekap_all['Kabupaten_Kota']==selected_kab_kota) & (dm.df_rekap_all['Kecamatan']==selected_kecamatan)
-        selection3 = (dm.metadata['PROV']==selected_provinsi) & (dm.metadata['KOTA_KAB']==selected_kab_kota) & (dm.metadata['KEC']==selected_kecamatan)
-    else:
-        selection1 = (dm.df['PROV']==selected_provinsi) & (dm.df['KOTA_KAB']==selected_kab_kota) & (dm.df['KEC']==selected_kecamatan) & (dm.df['KEL']==selected_kelurahan)
-        selection2 = (dm.df_rekap_all['Provinsi']==selected_provinsi) & (dm.df_rekap_all['Kabupaten_Kota']==selected_kab_kota) & (dm.df_rekap_all['Kecamatan']==selected_kecamatan) & (dm.df_rekap_all['Kelurahan']==selected_kelurahan)
-        selection3 = (dm.metadata['PROV']==selected_provinsi) & (dm.metadata['KOTA_KAB']==selected_kab_kota) & (dm.metadata['KEC']==selected_kecamatan) & (dm.metadata['KEL']==selected_kelurahan)
+    # location node of the selection, rows of the selected region are queried from the database
+    location = (selected_provinsi, selected_kab_kota, selected_kecamatan, selected_kelurahan)
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Local Data Mart
 
-    dm.get_total_number(selection1, selection3, target_column, selected_category)
-    dm.get_agg_status(selection1, target_column, selected_category)
+    dm.get_total_number(location, target_column, selected_category)
+    dm.get_agg_status(location, target_column, selected_category)
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Title and Subtitle
@@ -295,8 +274,7 @@ if st.session_state.authentication_status:
             )
             pie2.plotly_chart(fig, use_container_width=True)
 
-        data = dm.df[selection1]
-        target_barchart(dm.get_agg_target(data, target_column))
+        target_barchart(dm.get_agg_target(location, target_column))
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Tabel Rekapitulasi
@@ -304,7 +282,8 @@ if st.session_state.authentication_status:
 
     if selected_kab_kota == 'ALL':
         title = 'Tabel Rekapitulasi Level Kabupaten / Kota'
-        filter_1 = dm.df_rekap_kab['Kabupaten_Kota'].isin(list_kabkota_prov)
+        # children of the selected node (full path, same names in other regions are excluded)
+        filter_1 = dm.df_rekap_kab['Provinsi'] == selected_provinsi
         # category filter
         if selected_category is not None:
             filter_2 = dm.df_rekap_kab[target_column] == selected_category
@@ -314,7 +293,7 @@ if st.session_state.authentication_status:
         data = dm.df_rekap_kab[filter_1 & filter_2]
     elif selected_kecamatan == 'ALL':
         title = 'Tabel Rekapitulasi Level Kecamatan'
-        filter_1 = dm.df_rekap_kec['Kecamatan'].isin(list_kec_kabkota)
+        filter_1 = (dm.df_rekap_kec['Provinsi'] == selected_provinsi) & (dm.df_rekap_kec['Kabupaten_Kota'] == selected_kab_kota)
         # category filter
         if selected_category is not None:
             filter_2 = dm.df_rekap_kec[target_column] == selected_category
@@ -324,7 +303,7 @@ if st.session_state.authentication_status:
         data = dm.df_rekap_kec[filter_1 & filter_2]
     elif selected_kelurahan == 'ALL':
         title = 'Tabel Rekapitulasi Level Kelurahan'
-        filter_1 = dm.df_rekap_kel['Kelurahan'].isin(list_kel_kec)
+        filter_1 = (dm.df_rekap_kel['Provinsi'] == selected_provinsi) & (dm.df_rekap_kel['Kabupaten_Kota'] == selected_kab_kota) & (dm.df_rekap_kel['Kecamatan'] == selected_kecamatan)
         # category filter
         if selected_category is not None:
             filter_2 = dm.df_rekap_kel[target_column] == selected_category
@@ -334,7 +313,7 @@ if st.session_state.authentication_status:
         data = dm.df_rekap_kel[filter_1 & filter_2]
     else:
         title = 'Tabel Rekapitulasi Level Kelurahan'
-        filter_1 = dm.df_rekap_kel['Kelurahan'] == selected_kelurahan
+        filter_1 = (dm.df_rekap_kel['Provinsi'] == selected_provinsi) & (dm.df_rekap_kel['Kabupaten_Kota'] == selected_kab_kota) & (dm.df_rekap_kel['Kecamatan'] == selected_kecamatan) & (dm.df_rekap_kel['Kelurahan'] == selected_kelurahan)
         if selected_category is not None:
             filter_2 = dm.df_rekap_kel[target_column] == selected_category
             title += f' (Category: {selected_category})'
@@ -342,6 +321,9 @@ if st.session_state.authentication_status:
             filter_2 = pd.Series([True] * len(dm.df_rekap_kel))
         data = dm.df_rekap_kel[filter_1 & filter_2]
     
+    # parent regions are row keys only
+    regions = [i for i in ['Provinsi', 'Kabupaten_Kota', 'Kecamatan', 'Kelurahan'] if i in data.columns]
+    data = data.drop(regions[:-1], axis=1)
     if target_column is not None:
         data = data.drop([target_column], axis=1)
     st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
@@ -364,18 +346,12 @@ if st.session_state.authentication_status:
 
     with expander:
 
-        data = dm.df_rekap_all
+        data = dm.query_table('rekap_all', location, list(REGIONS.keys()), target_column, selected_category)
         # category filter
         if target_column is not None:
-            filter_ = data[target_column] == selected_category
             title = f'Category: {selected_category}'
             st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
-        else:
-            filter_ = pd.Series([True] * len(data))
-
-        if target_column is not None:
             data = data.drop([target_column], axis=1)
-        data = data[selection2 & filter_]
         height = get_table_height(data)
 
         gb = GridOptionsBuilder.from_dataframe(data)
@@ -392,23 +368,26 @@ if st.session_state.authentication_status:
 
     with st.expander('Raw Table (Filtered By Region Only)'):
 
-        data = dm.df[selection1]
-        height = get_table_height(data)
-
-        gb = GridOptionsBuilder.from_dataframe(data)
-        gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
-        gridOptions = gb.build()
-        gridOptions['getRowStyle'] = jscode1
-
-        AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, allow_unsafe_jscode=True, height=height, enableSorting=True, enableFilter=True, update_mode=GridUpdateMode.VALUE_CHANGED)
-
-        # Create a download button
-        st.download_button(
-            "Download Table",
-            data=download_dataframe_as_excel(data.drop(['Link'], axis=1)),
-            file_name=f"raw_data_{selected_provinsi}_{selected_kab_kota}_{selected_kecamatan}_{selected_kelurahan}.xlsx",
-            mime="application/vnd.ms-excel",
-        )
+        # wide submissions are only read when asked for
+        if st.checkbox('Load Table', key='raw_table_local'):
+            data = dm.query_table('submissions', location)
+            height = get_table_height(data)
+
+            gb = GridOptionsBuilder.from_dataframe(data)
+            gb.configure_column('Link', cellRenderer=cell_link, pinned='right')
+            gridOptions = gb.build()
+            gridOptions['context'] = get_grid_context(nama_survei, selected_category)
+            gridOptions['getRowStyle'] = jscode1
+
+            AgGrid(data, gridOptions=gridOptions, enable_enterprise_modules=True, allow_unsafe_jscode=True, height=height, enableSorting=True, enableFilter=True, update_mode=GridUpdateMode.VALUE_CHANGED)
+
+            # Create a download button
+            st.download_button(
+                "Download Table",
+                data=download_dataframe_as_excel(data),
+                file_name=f"raw_data_{selected_provinsi}_{selected_kab_kota}_{selected_kecamatan}_{selected_kelurahan}.xlsx",
+                mime="application/vnd.ms-excel",
+            )
 
     # ----------------------------------------------------------------------------------------------------------------------------
     # Last update
@@ -110,45 +110,24 @@ if st.session_state.authentication_status:
                         regions = ['PROV', 'KOTA_KAB', 'KEC', 'KEL']
                         data[regions] = data[regions].applymap(lambda x: x.upper() if isinstance(x, str) else x)
                         metadata = data.copy()
+                        # targets per location (kelurahan level)
+                        targets = get_targets(metadata, target_column)
                         # set empty dictionary
                         if target_column is not None:
-                            data = data.melt(id_vars=regions, value_vars=target_categories)
-                            targets = {cat:{} for cat in target_categories}
                             list_location = {'all': {}}
                             list_location.update({cat:{} for cat in target_categories})
                         else:
-                            targets = {}
                             list_location = {}
                         for region in regions:
-                            # get target
+                            # get list of locations
                             if target_column is not None:
                                 list_location['all'].update({region : metadata[region].unique().tolist()})
                                 list_location['all'][region].sort()
-                                if region == 'PROV':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.variable}', axis=1)
-                                elif region == 'KOTA_KAB':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.variable}', axis=1)
-                                elif region == 'KEC':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.variable}', axis=1)
-                                elif region == 'KEL':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}_{x.variable}', axis=1)
                                 for cat in target_categories:
-                                    targets[cat].update({region : data[data['variable']==cat].groupby('loc_id').sum('value').to_dict()['value']})
-                                    # get list of locations
                                     list_location[cat].update({region : metadata[metadata[cat]>0][region].unique().tolist()})
                                     list_location[cat][region].sort()
                                 list_not_exist = [i for i in list_location['all'][region] if i not in [j for _,j in internal_decoder[region].items()]]
                             else:
-                                if region == 'PROV':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}', axis=1)
-                                elif region == 'KOTA_KAB':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}', axis=1)
-                                elif region == 'KEC':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}', axis=1)
-                                elif region == 'KEL':
-                                    data['loc_id'] = data.apply(lambda x : f'{x.PROV}_{x.KOTA_KAB}_{x.KEC}_{x.KEL}', axis=1)
-                                targets.update({region : data.groupby('loc_id').sum('JML').to_dict()['JML']})
-                                # get list of locations
                                 list_location.update({region : metadata[region].unique().tolist()})
                                 list_location[region].sort()
                                 list_not_exist = [i for i in list_location[region] if i not in [j for _,j in internal_decoder[region].items()]]
@@ -176,27 +155,34 @@ if st.session_state.authentication_status:
                 # Check if name exists
                 if survey_name in list_survei:
                     st.warning('survey name already exists')
+                elif is_reserved_name(survey_name):
+                    st.warning('survey name is reserved')
                 elif not st.session_state.check:
                     st.warning('fix the error')
                 else:
                     # download process
                     with st_lottie_spinner(get_lottie_wait(), height=200, key='lottie_download'):
                         try:
-                            # download data
-                            if 'decoder' in st.session_state:
-                                df = download_data(form_id, wilayah, st.session_state.decoder)
-                            else:
-                                df = download_data(form_id, wilayah, None)
-
-                            if 'decoder' in st.session_state:
-                                decoder = st.session_state.decoder
-                            else:
-                                decoder = None
-                            # data preprocessing
-                            generate_datalake(survey_name, df, targets, target_column, metadata)
+                            # stage timings of the first load (Performance page)
+                            with trace(survey_name):
+                                # download data
+                                with span('download') as record:
+                                    if 'decoder' in st.session_state:
+                                        df = download_data(form_id, wilayah, st.session_state.decoder)
+                                    else:
+                                        df = download_data(form_id, wilayah, None)
+                                    record['Rows'] = len(df)
+
+                                if 'decoder' in st.session_state:
+                                    decoder = st.session_state.decoder
+                                else:
+                                    decoder = None
+                                # data preprocessing
+                                with span('build', rows=len(df)):
+                                    generate_datalake(survey_name, df, targets, target_column, metadata)
                             list_location = json.dumps(list_location) 
                             wilayah = json.dumps(wilayah)   
-                            targets = json.dumps(targets)
+                            targets = dump_targets(targets)
                             if decoder is not None:
                                 decoder = json.dumps(decoder)
                             # insert survey_name into 'list_surveys' table
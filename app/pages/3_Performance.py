@@ -0,0 +1,165 @@
+import sys
+sys.path.append('../')
+from module import *
+import streamlit as st
+import plotly.graph_objects as go
+import streamlit_authenticator as stauth
+from streamlit_lottie import st_lottie
+from st_aggrid import AgGrid, GridOptionsBuilder
+
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# Set Page Layout
+
+st.set_page_config(page_title='Performance - QC Dashboard', layout='wide', page_icon='☕')
+st.markdown(st_style, unsafe_allow_html=True)
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# Authentication
+
+authenticator = stauth.Authenticate(
+    auth_config['credentials'],
+    auth_config['cookie']['name'],
+    auth_config['cookie']['key'],
+    auth_config['cookie']['expiry_days'],
+    auth_config['preauthorized']
+)
+
+if 'authentication_status' in st.session_state:
+    if not st.session_state.authentication_status:
+        name, authentication_status, username = authenticator.login('Login', 'main')
+        if st.session_state.authentication_status == False:
+            st.error('Username/password is incorrect')
+        elif st.session_state.authentication_status == None:
+            st.warning('Please enter your username and password')
+else:
+    name, authentication_status, username = authenticator.login('Login', 'main')
+    if st.session_state.authentication_status == False:
+        st.error('Username/password is incorrect')
+    elif st.session_state.authentication_status == None:
+        st.warning('Please enter your username and password') 
+
+if st.session_state.authentication_status:
+    if st.session_state.name != 'viewers only':
+
+# ----------------------------------------------------------------------------------------------------------------------------
+
+        # Title
+        title = "Refresh Performance" 
+        st.markdown(f"<h1 style='text-align: center; color: black; font-size:32px;'>{title}</h1>", unsafe_allow_html=True)
+
+        # Add image to the sidebar
+        draw_logo()
+
+        # ----------------------------------------------------------------------------------------------------------------------------
+        # Add logout button
+        st.sidebar.markdown("---")
+        authenticator.logout('Logout', 'sidebar')
+
+        # load stage timings
+        metrics = load_metrics()
+        if len(metrics) == 0:
+            st.warning('No stage timings recorded yet.')
+            st.stop()
+        metrics['MB'] = (metrics['Bytes'] / 1e6).round(2)
+        metrics['Seconds'] = metrics['Seconds'].round(3)
+        metrics['Rows'] = metrics['Rows'].astype('Int64')
+
+        # top-level stages of a refresh (download & build) and of a session (datamart load), the other stages are nested
+        top_stages = ['download', 'build', 'datamart load']
+        runs = metrics[metrics['Stage'].isin(top_stages)].pivot_table(index=['Survey Name', 'Run'], columns='Stage', values='Seconds', aggfunc='sum')
+        runs = runs.reindex(columns=top_stages).reset_index()
+        runs['Refresh'] = runs[['download', 'build']].sum(axis=1, min_count=1)
+
+        # ------------------------------------------------------------------------------------------------------------
+        # Last refresh of each survey
+        title = 'Last Refresh per Survey'
+        st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
+
+        refreshes = runs[runs['Refresh'].notna()]
+        data = refreshes.sort_values('Run').groupby('Survey Name').last().reset_index()
+        # slowest nested stage of the last refresh
+        nested = metrics[~metrics['Stage'].isin(top_stages)].merge(data[['Survey Name', 'Run']], on=['Survey Name', 'Run'])
+        slowest = nested.sort_values('Seconds').groupby('Survey Name').last()
+        data['Slowest Stage'] = data['Survey Name'].map(slowest['Stage'])
+        data['Slowest Stage (s)'] = data['Survey Name'].map(slowest['Seconds'])
+        data['Run'] = data['Run'].map(get_run_time)
+        data = data[['Survey Name', 'Run', 'download', 'build', 'Refresh', 'Slowest Stage', 'Slowest Stage (s)']].sort_values('Refresh', ascending=False)
+        data.columns = ['Survey Name', 'Last Refresh', 'Download (s)', 'Build (s)', 'Total (s)', 'Slowest Stage', 'Slowest Stage (s)']
+        data = data.round(2)
+        gb = GridOptionsBuilder.from_dataframe(data)
+        AgGrid(data, gridOptions=gb.build(), enable_enterprise_modules=False, height=get_table_height(data) + 15)
+
+        # ------------------------------------------------------------------------------------------------------------
+        # Timing history of a survey
+        st.markdown("---")
+        list_survei = sorted(metrics['Survey Name'].unique().tolist())
+        selected_survey = st.sidebar.selectbox('Survey', list_survei)
+
+        title = f'Timing History ({selected_survey})'
+        st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
+
+        history = runs[runs['Survey Name']==selected_survey].sort_values('Run')
+        fig = go.Figure(data=[go.Scatter(x=history[history[stage].notna()]['Run'], y=history[history[stage].notna()][stage], mode='lines+markers', name=stage) for stage in top_stages])
+        fig.update_layout(
+            xaxis_title='Run',
+            yaxis_title='Seconds',
+            font={'size': 14},
+            margin={'t': 20},
+            height=350
+            )
+        st.plotly_chart(fig, use_container_width=True)
+
+        # ------------------------------------------------------------------------------------------------------------
+        # Stages of a run
+        st.markdown("---")
+        list_run = history['Run'].sort_values(ascending=False).tolist()
+        selected_run = st.sidebar.selectbox('Run', list_run, format_func=get_run_time)
+
+        title = f'Stages ({get_run_time(selected_run)})'
+        st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
+
+        data = metrics[(metrics['Survey Name']==selected_survey) & (metrics['Run']==selected_run)][['Stage', 'Seconds', 'Rows', 'MB']]
+        stages = data[~data['Stage'].isin(top_stages)].groupby('Stage', sort=False)['Seconds'].sum().sort_values()
+        fig = go.Figure(data=[go.Bar(x=stages.values, y=stages.index, orientation='h', marker={'color': '#AEC7E8'})])
+        fig.update_layout(
+            xaxis_title='Seconds',
+            font={'size': 14},
+            margin={'t': 20},
+            height=max(250, 30 * len(stages))
+            )
+        st.plotly_chart(fig, use_container_width=True)
+
+        gb = GridOptionsBuilder.from_dataframe(data)
+        AgGrid(data, gridOptions=gb.build(), enable_enterprise_modules=False, height=get_table_height(data) + 15)
+
+        # ------------------------------------------------------------------------------------------------------------
+        # Datamarts cached by the dashboard process
+        st.markdown("---")
+
+        title = f'Datamart Cache (budget {DATAMART_CACHE_MB} MB)'
+        st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
+
+        data = pd.DataFrame(datamarts.get_usage(), columns=['Survey Name', 'Version', 'MB']).round(1)
+        gb = GridOptionsBuilder.from_dataframe(data)
+        AgGrid(data, gridOptions=gb.build(), enable_enterprise_modules=False, height=get_table_height(data) + 15)
+
+        # loaded tables, memory as read from the datalake & after dtype optimisation
+        title = 'Datamart Tables'
+        st.markdown(f"<h6>{title}</h6>", unsafe_allow_html=True)
+
+        data = pd.DataFrame(datamarts.get_table_usage(), columns=['Survey Name', 'Table', 'Raw MB', 'Optimised MB'])
+        data['Saved %'] = (100 * (1 - data['Optimised MB'] / data['Raw MB'].where(data['Raw MB'] > 0))).fillna(0)
+        data = data.round(1)
+        gb = GridOptionsBuilder.from_dataframe(data)
+        AgGrid(data, gridOptions=gb.build(), enable_enterprise_modules=False, height=get_table_height(data) + 15)
+
+    else:
+        st.error('You need to be an administrator or a data manager to access this page.')
+        draw_logo()
+        authenticator.logout('Logout', 'sidebar')
+        st.markdown('#')
+        st_lottie(get_lottie_forbidden(), height=200)
+
+else:
+    draw_logo()
@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import pandas as pd
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from module import get_json, get_scto_client, download_data
+from synthetic import get_hierarchy, generate_submissions
+
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# Local stand-in for the subset of the SurveyCTO REST API used by pysurveycto:
+#
+#   GET    /api/v1/forms/data/wide/json/<form_id>?r=approved,rejected,pending
+#   GET    /api/v2/forms/data/wide/json/<form_id>?date=<oldest completion date>&r=approved|rejected|pending
+#   GET    /api/v1/forms/data/wide/csv/<form_id>?r=approved,rejected,pending
+#   POST   /api/v1/forms/settings/csv/linebreak
+#   DELETE /api/v1/forms/settings/csv/linebreak
+#
+# Review statuses are separated by commas (v1) or pipes (v2), only approved submissions are returned without them.
+#
+# Serve (point the dashboard / updater to it with SCTO_BASE_URL=http://localhost:8000):
+#   python app/scto_server.py serve --rows 100000 --latency 0.5 --error-rate 0.05 --max-rps 2
+# Re-reviews (approved <-> rejected) of submissions completed before each incremental download, which the
+# date filter does not return (caught by the next full download):
+#   python app/scto_server.py serve --rereviews 10
+# Record a real form as fixture (served instead of synthetic data):
+#   python app/scto_server.py record <form_id>
+# Check that an incremental download returns new submissions in all review statuses (pending included):
+#   python app/scto_server.py check
+
+FIXTURES_DIR = 'app/fixtures'
+DATE_FORMAT = '%b %d, %Y %I:%M:%S %p'
+REVIEW_STATUS = {'approved': 'APPROVED', 'rejected': 'REJECTED', 'pending': 'NONE'}
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# FORMS
+
+class form_store():
+
+    def __init__(self, fixtures_dir, n_rows, n_locations, seed, rereviews=0):
+        self.fixtures_dir = fixtures_dir
+        self.n_rows = n_rows
+        self.n_locations = n_locations
+        self.seed = seed
+        self.rereviews = rereviews
+        self.forms = {}
+        self.payloads = {}
+        self.lock = threading.Lock()
+        self.hierarchy = None
+
+    # recorded fixture if available, otherwise synthetic submissions
+    def get_form(self, form_id):
+        with self.lock:
+            if form_id not in self.forms:
+                fixture = os.path.join(self.fixtures_dir, f'{form_id}.json')
+                if os.path.exists(fixture):
+                    df = pd.DataFrame(get_json(fixture))
+                else:
+                    if self.hierarchy is None:
+                        self.hierarchy = get_hierarchy()
+                    df = generate_submissions(self.hierarchy, self.n_rows, n_locations=self.n_locations, seed=self.seed)
+                df['_completion'] = pd.to_datetime(df['CompletionDate'], format=DATE_FORMAT)
+                self.forms[form_id] = df
+            return self.forms[form_id]
+
+    # review status of n reviewed submissions completed before a date is switched (completion date unchanged)
+    def rereview(self, form_id, oldest_completion_date, n):
+        df = self.get_form(form_id)
+        with self.lock:
+            reviewed = df.index[(df['_completion'] <= oldest_completion_date) & df['review_status'].isin(['APPROVED', 'REJECTED'])].tolist()
+            idx = random.sample(reviewed, min(n, len(reviewed)))
+            df.loc[idx, 'review_status'] = df.loc[idx, 'review_status'].map({'APPROVED': 'REJECTED', 'REJECTED': 'APPROVED'})
+            self.payloads = {k: v for k, v in self.payloads.items() if k[0] != form_id}
+        return df.loc[idx, 'KEY'].tolist()
+
+    # payloads of whole forms are cached per form, format & review statuses, date filtered payloads (incremental
+    # downloads, a new date on every refresh) are serialized on each request
+    def get_payload(self, path, query):
+        parts = path.strip('/').split('/')
+        version, data_format, form_id = parts[1], parts[-2], parts[-1]
+        review_status = [REVIEW_STATUS[i] for i in re.split('[,|]', query.get('r', ['approved'])[0])]
+        date = query.get('date', ['0'])[0] if version == 'v2' else '0'
+        key = (form_id, data_format, tuple(sorted(review_status)))
+        if (date == '0') and (key in self.payloads):
+            return self.payloads[key]
+        df = self.get_form(form_id)
+        if date != '0':
+            oldest_completion_date = datetime.strptime(unquote(date), DATE_FORMAT)
+            # reviews done on the server since the previous download
+            if self.rereviews > 0:
+                self.rereview(form_id, oldest_completion_date, self.rereviews)
+            df = df[df['_completion'] > oldest_completion_date]
+        df = df[df['review_status'].isin(review_status)]
+        payload = serialize(df.drop(['_completion'], axis=1), data_format)
+        if date == '0':
+            self.payloads[key] = payload
+        return payload
+
+# payload & content type of submissions
+def serialize(df, data_format):
+    if data_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8'), 'text/csv'
+    return df.to_json(orient='records').encode('utf-8'), 'application/json'
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# SERVER
+
+class scto_handler(BaseHTTPRequestHandler):
+
+    # simulated latency, errors & throttling
+    def simulate(self):
+        config = self.server.config
+        time.sleep(max(0, random.gauss(config.latency, config.latency / 4)))
+        if random.random() < config.error_rate:
+            self.send_payload(500, b'{"error": {"message": "simulated server error"}}', 'application/json')
+            return False
+        if config.max_rps > 0:
+            with self.server.lock:
+                now = time.time()
+                self.server.requests = [i for i in self.server.requests if now - i < 1] + [now]
+                throttled = len(self.server.requests) > config.max_rps
+            if throttled:
+                self.send_payload(429, b'{"error": {"message": "too many requests"}}', 'application/json', {'Retry-After': '1'})
+                return False
+        return True
+
+    def send_payload(self, status, payload, content_type, headers={}):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if not self.simulate():
+            return
+        url = urlparse(self.path)
+        if url.path.startswith('/api/v1/forms/data/wide/') or url.path.startswith('/api/v2/forms/data/wide/'):
+            try:
+                payload, content_type = self.server.store.get_payload(url.path, parse_qs(url.query))
+            except Exception as e:
+                self.send_payload(417, json.dumps({'error': {'message': str(e)}}).encode('utf-8'), 'application/json')
+                return
+            self.send_payload(200, payload, content_type)
+        else:
+            self.send_payload(404, b'{"error": {"message": "not found"}}', 'application/json')
+
+    # csv line break settings
+    def do_POST(self):
+        if self.simulate():
+            self.send_payload(200, b'{}', 'application/json')
+
+    def do_DELETE(self):
+        if self.simulate():
+            self.send_payload(200, b'{}', 'application/json')
+
+    def log_message(self, format, *args):
+        if not self.server.config.quiet:
+            super().log_message(format, *args)
+
+# stand-in server
+def get_server(config):
+    server = ThreadingHTTPServer((config.host, config.port), scto_handler)
+    server.config = config
+    server.store = form_store(config.fixtures, config.rows, config.locations, config.seed, config.rereviews)
+    server.lock = threading.Lock()
+    server.requests = []
+    return server
+
+# run stand-in server
+def serve(config):
+    server = get_server(config)
+    print(f'SurveyCTO stand-in server on http://{config.host}:{config.port}')
+    server.serve_forever()
+
+# incremental download of the latest submissions of a form, one of them pending review, from a stand-in server
+def check(config):
+    server = get_server(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    get_scto_client().base_url = f'http://{config.host}:{server.server_address[1]}'
+    df = server.store.get_form(config.form_id)
+    oldest_completion_date = df['_completion'].sort_values().iloc[-config.new]
+    latest = df.index[df['_completion'] > oldest_completion_date]
+    df.loc[latest[0], 'review_status'] = 'NONE'
+    pending = df.loc[latest[0], 'KEY']
+    res = download_data(config.form_id, {}, None, oldest_completion_date=oldest_completion_date.to_pydatetime())
+    server.shutdown()
+    keys = [] if res is None else res['KEY'].tolist()
+    print(f'{len(keys)} of {len(latest)} new submissions downloaded, pending submission {"included" if pending in keys else "missing"}')
+    if (pending not in keys) or (len(keys) != len(latest)):
+        raise SystemExit('check: incremental download does not return all new submissions')
+
+# record a form from the SurveyCTO server as fixture
+def record(config):
+    res = get_scto_client().get_form_data(config.form_id, format='json', shape='wide', review_status=['approved', 'rejected', 'pending'])
+    os.makedirs(config.fixtures, exist_ok=True)
+    with open(os.path.join(config.fixtures, f'{config.form_id}.json'), 'w') as f:
+        json.dump(res, f)
+    print(f'{len(res)} submissions saved to {config.fixtures}/{config.form_id}.json')
+
+# ----------------------------------------------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local SurveyCTO stand-in server')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_serve = subparsers.add_parser('serve')
+    parser_serve.add_argument('--host', default='127.0.0.1')
+    parser_serve.add_argument('--port', type=int, default=8000)
+    parser_serve.add_argument('--fixtures', default=FIXTURES_DIR, help='directory of recorded <form_id>.json payloads')
+    parser_serve.add_argument('--rows', type=int, default=10000, help='synthetic submissions per form')
+    parser_serve.add_argument('--locations', type=int, default=500, help='synthetic kelurahan per form')
+    parser_serve.add_argument('--seed', type=int, default=0)
+    parser_serve.add_argument('--latency', type=float, default=0, help='mean response latency (seconds)')
+    parser_serve.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 500')
+    parser_serve.add_argument('--max-rps', type=float, default=0, help='requests per second before answering 429 (0 = unlimited)')
+    parser_serve.add_argument('--rereviews', type=int, default=0, help='submissions re-reviewed before each incremental download')
+    parser_serve.add_argument('--quiet', action='store_true')
+    parser_record = subparsers.add_parser('record')
+    parser_record.add_argument('form_id')
+    parser_record.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser_check = subparsers.add_parser('check')
+    parser_check.add_argument('--form-id', default='check')
+    parser_check.add_argument('--rows', type=int, default=1000, help='synthetic submissions')
+    parser_check.add_argument('--new', type=int, default=100, help='submissions completed after the incremental date')
+    parser_check.set_defaults(host='127.0.0.1', port=0, fixtures=FIXTURES_DIR, locations=100, seed=0, latency=0, error_rate=0, max_rps=0, rereviews=0, quiet=True)
+    config = parser.parse_args()
+    if config.command == 'serve':
+        serve(config)
+    elif config.command == 'check':
+        check(config)
+    else:
+        record(config)
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from module import get_internal_decoder
+
+
+# ----------------------------------------------------------------------------------------------------------------------------
+# SYNTHETIC SURVEYCTO DATA
+
+NAMES = ['AGUS', 'BUDI', 'DEWI', 'EKA', 'FITRI', 'HADI', 'INDAH', 'JOKO', 'KARTIKA', 'LESTARI', 'MADE', 'NUR', 'PUTRI', 'RAHMAT', 'SITI', 'TAUFIK', 'UTAMI', 'WAHYU', 'YULI', 'ZAINAL']
+STATUS = ['APPROVED', 'REJECTED', 'NONE']
+
+# assign ordered children to ordered parents proportionally to the parents' weights
+def split_ordered(n_children, weights):
+    share = np.cumsum(weights) / np.sum(weights)
+    return np.searchsorted(share, (np.arange(n_children) + 0.5) / n_children)
+
+# location hierarchy (codes) drawn from the internal decoder
+def get_hierarchy():
+    # the province of each kecamatan is given by its code prefix (in province order), kabupaten and kelurahan codes
+    # are in BPS order without parent, they are distributed in order over their parents
+    internal_decoder = get_internal_decoder()
+    prov = sorted(internal_decoder['PROV'].keys(), key=int)
+    kab = sorted(internal_decoder['KOTA_KAB'].keys(), key=int)
+    kel = sorted(internal_decoder['KEL'].keys(), key=int)
+    kec = pd.DataFrame({'KEC': list(internal_decoder['KEC'].keys())})
+    kec['prefix'] = kec['KEC'].str.extract(r'^([A-Z]+)', expand=False)
+    kec['number'] = kec['KEC'].str.extract(r'([0-9]+)$', expand=False).astype(int)
+    kec['PROV'] = kec['prefix'].map({p: prov[i] for i, p in enumerate(kec['prefix'].unique())})
+    kec = kec.sort_values(['PROV', 'number'], key=lambda x: x.astype(int) if x.name == 'PROV' else x).reset_index(drop=True)
+    # kabupaten per provinsi
+    n_kec_prov = kec.groupby('PROV', sort=False).size()
+    kab_prov = pd.DataFrame({'KOTA_KAB': kab, 'PROV': n_kec_prov.index[split_ordered(len(kab), n_kec_prov.values)]})
+    # kecamatan per kabupaten
+    kec['KOTA_KAB'] = ''
+    for p, idx in kec.groupby('PROV', sort=False).groups.items():
+        kabs = kab_prov[kab_prov['PROV'] == p]['KOTA_KAB'].values
+        kec.loc[idx, 'KOTA_KAB'] = kabs[split_ordered(len(idx), np.ones(len(kabs)))]
+    # kelurahan per kecamatan
+    hierarchy = kec.iloc[split_ordered(len(kel), np.ones(len(kec)))][['PROV', 'KOTA_KAB', 'KEC']].reset_index(drop=True)
+    hierarchy['KEL'] = kel
+    return hierarchy
+
+# labels of a hierarchy (as written in the target plan)
+def get_hierarchy_labels(hierarchy):
+    internal_decoder = get_internal_decoder()
+    labels = hierarchy.copy()
+    for f in ['PROV', 'KOTA_KAB', 'KEC', 'KEL']:
+        labels[f] = labels[f].map(internal_decoder[f]).str.upper()
+    return labels
+
+# wide submissions as returned by SurveyCTO (all values are strings)
+def generate_submissions(hierarchy, n_rows, n_locations=100, n_questions=5, target_column=None, categories=None,
+                         status_mix=(0.6, 0.1, 0.3), unknown_rate=0.01, start=datetime(2023, 1, 1), seed=0):
+    rng = np.random.default_rng(seed)
+    locations = hierarchy.sample(min(n_locations, len(hierarchy)), random_state=seed).reset_index(drop=True)
+    loc = rng.integers(0, len(locations), n_rows)
+    df = locations.iloc[loc].reset_index(drop=True)
+    # unknown kecamatan / kelurahan are written in the 'LAINNYA' fields
+    df['KEC_LAINNYA'] = ''
+    df['KEL_LAINNYA'] = ''
+    unknown = rng.random(n_rows) < unknown_rate
+    df.loc[unknown, 'KEC'] = '0'
+    df.loc[unknown, 'KEC_LAINNYA'] = 'kecamatan lainnya'
+    df.loc[unknown, 'KEL'] = '0'
+    df.loc[unknown, 'KEL_LAINNYA'] = 'kelurahan lainnya'
+    # dates
+    completion = pd.Series(pd.to_datetime(start) + pd.to_timedelta(np.sort(rng.integers(0, 90 * 86400, n_rows)), unit='s'))
+    df['SubmissionDate'] = (completion + timedelta(minutes=5)).dt.strftime('%b %-d, %Y %-I:%M:%S %p')
+    df['CompletionDate'] = completion.dt.strftime('%b %-d, %Y %-I:%M:%S %p')
+    # respondents
+    names = pd.Series(NAMES)
+    df['RW'] = pd.Series(rng.integers(1, 20, n_rows)).astype(str).str.zfill(2)
+    df['RT'] = pd.Series(rng.integers(1, 30, n_rows)).astype(str).str.zfill(3)
+    df['NAMA_KK'] = names.iloc[rng.integers(0, len(names), n_rows)].values + ' ' + names.iloc[rng.integers(0, len(names), n_rows)].values
+    df['NAMA_RESPONDEN'] = names.iloc[rng.integers(0, len(names), n_rows)].values + ' ' + names.iloc[rng.integers(0, len(names), n_rows)].values
+    df['NAMA_ENUM'] = 'ENUM ' + pd.Series(loc % 50).astype(str)
+    df['JK'] = rng.integers(0, 2, n_rows).astype(str)
+    df['WILAYAH'] = ''
+    # the target column is kept by download_data as a '_X' column
+    if target_column is not None:
+        df[f'{target_column}_X'] = np.array(categories)[rng.integers(0, len(categories), n_rows)]
+    for i in range(n_questions):
+        df[f'Q{i + 1}_X'] = rng.integers(1, 6, n_rows).astype(str)
+    # review
+    df['review_status'] = np.array(STATUS)[rng.choice(len(STATUS), n_rows, p=np.array(status_mix) / np.sum(status_mix))]
+    df['CATATAN_QC'] = ''
+    df['KEY'] = 'uuid:' + pd.Series(rng.integers(0, 2**63, n_rows, dtype=np.int64)).apply(lambda x : f'{x:016x}') + '-' + pd.Series(np.arange(n_rows)).astype(str)
+    return df
+
+# target plan of a set of locations (labels), as uploaded in Manage Data (metadata)
+def generate_target_plan(labels, target_column=None, categories=None, max_target=20, seed=0):
+    rng = np.random.default_rng(seed)
+    metadata = labels[['PROV', 'KOTA_KAB', 'KEC', 'KEL']].drop_duplicates().reset_index(drop=True)
+    metadata['WILAYAH'] = np.array(['URBAN', 'RURAL'])[rng.integers(0, 2, len(metadata))]
+    if target_column is not None:
+        for cat in categories:
+            metadata[cat] = rng.integers(0, max_target, len(metadata))
+    else:
+        metadata['JML'] = rng.integers(0, max_target, len(metadata))
+    return metadata
+
+# write a target plan as uploaded in Manage Data (target_split.xlsx format with target column, target.xlsx format without)
+def write_target_plan(path, metadata, target_column=None, categories=None):
+    if target_column is not None:
+        with pd.ExcelWriter(path) as writer:
+            pd.DataFrame({target_column: categories}).to_excel(writer, sheet_name='TARGET_COLUMN', index=False)
+            metadata.to_excel(writer, sheet_name='DATA', index=False)
+    else:
+        metadata.to_excel(path, index=False)
+
+# read a target plan file as in Manage Data: metadata & target column
+def read_target_plan(path):
+    try:
+        target_column = pd.read_excel(path, sheet_name='TARGET_COLUMN').columns[0]
+        metadata = pd.read_excel(path, sheet_name='DATA')
+    except ValueError:
+        target_column = None
+        metadata = pd.read_excel(path)
+    regions = ['PROV', 'KOTA_KAB', 'KEC', 'KEL']
+    metadata[regions] = metadata[regions].applymap(lambda x: x.upper() if isinstance(x, str) else x)
+    return metadata, target_column
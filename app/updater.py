@@ -1,12 +1,15 @@
 import os
-os.chdir('/app')
+os.chdir(os.getenv('APP_DIR', '/app'))
+import sys
 import time
 import json
+import logging
 import sqlite3
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
-from module import download_data, generate_datalake
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from module import download_data, generate_datalake, get_high_water_mark, upsert_survey_table, load_survey_table, load_metadata, update_recaps, get_scto_client, get_targets, load_targets, get_reader, get_writer, trace, span, get_run_id, save_metrics
 
 
 
@@ -16,60 +19,162 @@ load_dotenv()
 
 WORK_DIR = 'app'
 JSON_DIR = 'app/json'
-DB_PATH = 'app/local.db'
+DB_PATH = os.getenv('DB_PATH', 'app/local.db')
 DECODER_FILE = 'app/decoder.xlsx'
 SERVER_NAME = os.getenv('SERVER_NAME')
 DASHBOARD_HOST = os.getenv('DASHBOARD_HOST')
 SCTO_USERNAME = os.getenv('SCTO_USERNAME')
 SCTO_PASSWORD = os.getenv('SCTO_PASSWORD')
+# 'incremental' (submissions completed since the last download) or 'full' (re-download whole forms)
+SYNC_MODE = os.getenv('SYNC_MODE', 'incremental')
+# in incremental mode, do a full download every N refreshes to catch deleted submissions and re-reviews of
+# submissions completed before the last download (their review status is stale until then)
+FULL_SYNC_EVERY = int(os.getenv('FULL_SYNC_EVERY', 6))
+# number of surveys downloaded in parallel
+MAX_DOWNLOAD_WORKERS = int(os.getenv('MAX_DOWNLOAD_WORKERS', 4))
+# number of datalakes built in parallel (writes are serialized on the writer connection)
+MAX_DATALAKE_WORKERS = int(os.getenv('MAX_DATALAKE_WORKERS', 1))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger('updater')
 
 # ------------------------------------------------------------------------------------
 
-def update():
+# get survey parameters from list_surveys table
+def get_parameters(list_surveys, i):
+    try:
+        decoder = json.loads(list_surveys.loc[i,'Decoder'])
+    except:
+        decoder = None
+    target_column = list_surveys.loc[i,'Target Column']
+    return {
+        'survey_name': list_surveys.loc[i,'Survey Name'],
+        'form_id': list_surveys.loc[i,'Form ID'],
+        'last_download': list_surveys.loc[i,'Last Download'],
+        'wilayah': json.loads(list_surveys.loc[i,'Wilayah']),
+        'targets': load_targets(list_surveys.loc[i,'Target'], target_column),
+        'target_column': target_column,
+        'decoder': decoder
+    }
+
+# download stage (network bound, runs in the download pool), stage timings are collected into the timings of the run
+def download_survey(params, full_sync, run, timings):
+    start = time.perf_counter()
+    # data is up to date as of the start of the download
+    download_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with trace(params['survey_name'], run, timings), span('download') as record:
+        if full_sync or (SYNC_MODE == 'full'):
+            df = download_data(params['form_id'], params['wilayah'], params['decoder'])
+            full_sync = True
+        else:
+            # new or re-reviewed submissions since last download
+            df = download_data(params['form_id'], params['wilayah'], params['decoder'], oldest_completion_date=get_high_water_mark(params['last_download']))
+        n_rows = 0 if df is None else len(df)
+        record['Rows'] = n_rows
+    logger.info(f"{params['survey_name']}: downloaded {n_rows} rows ({'full' if full_sync else 'incremental'}) in {time.perf_counter() - start:.1f}s")
+    return params, df, full_sync, download_time, run, timings
+
+# build stage (database bound, runs in the datalake pool), stage timings are collected into the timings of the run
+def build_survey(params, df, full_sync, download_time, run, timings):
+    with trace(params['survey_name'], run, timings), span('build', rows=0 if df is None else len(df)):
+        build_datalake(params, df, full_sync, download_time)
+
+# an incremental sync that cannot be applied (its writes are rolled back)
+class incremental_fallback(Exception):
+    pass
+
+def build_datalake(params, df, full_sync, download_time):
+    start = time.perf_counter()
+    survey_name = params['survey_name']
+    if df is not None:
+        metadata = load_metadata(survey_name)
+        # targets saved in the previous format are rebuilt from metadata
+        targets = params['targets'] if params['targets'] is not None else get_targets(metadata, params['target_column'])
+    if (not full_sync) and (df is not None):
+        plan_changed = False
+        # submissions are upserted and the recap tables updated in one transaction, both rolled back on failure
+        try:
+            with get_writer(DB_PATH) as conn:
+                cursor = conn.cursor()
+                df_old = upsert_survey_table(cursor, survey_name, df, params['target_column'])
+                if df_old is None:
+                    raise incremental_fallback('survey table cannot be upserted')
+                with span('update recaps', rows=len(df)):
+                    if not update_recaps(cursor, survey_name, df, df_old, targets, params['target_column']):
+                        plan_changed = True
+                        raise incremental_fallback('target plan changed')
+        # target plan changed: the datalake is rebuilt from the survey table with the submissions upserted in memory
+        except incremental_fallback as e:
+            if plan_changed:
+                logger.info(f'{survey_name}: {e}, rebuilding datalake')
+                df_all = load_survey_table(survey_name)
+                df = pd.concat([df_all[~df_all['KEY'].isin(df['KEY'])], df], ignore_index=True)
+            # fallback to full download
+            else:
+                logger.info(f'{survey_name}: {e}, falling back to full download')
+                df = download_data(params['form_id'], params['wilayah'], params['decoder'])
+            full_sync = True
+        except Exception:
+            logger.exception(f'{survey_name}: incremental sync failed, falling back to full download')
+            df = download_data(params['form_id'], params['wilayah'], params['decoder'])
+            full_sync = True
+
+    # full build (full download or fallback)
+    if full_sync and (df is not None):
+        generate_datalake(survey_name, df, targets, params['target_column'], metadata)
+
+    # update last_download in list_surveys table
+    update_sql = '''
+        UPDATE list_surveys 
+        SET [Last Download] = ?
+        WHERE [Survey Name] = ?
+    '''
+    with get_writer(DB_PATH) as conn:
+        conn.execute(update_sql, (download_time, survey_name))
+    logger.info(f'{survey_name}: datalake built in {time.perf_counter() - start:.1f}s')
+
+def update(full_sync=False):
+    start = time.perf_counter()
+    run = get_run_id()
+    # stage timings of all surveys, saved once at the end of the run
+    timings = []
     # load list_surveys table
-    conn = sqlite3.connect(DB_PATH)
-    list_surveys = pd.read_sql_query('SELECT * FROM list_surveys', conn)
-    conn.close()
+    list_surveys = pd.read_sql_query('SELECT * FROM list_surveys', get_reader(DB_PATH))
 
     # get parameters
-    for i in range(len(list_surveys)):
-        survey_name = list_surveys.loc[i,'Survey Name']
-        form_id = list_surveys.loc[i,'Form ID']
-        last_download = list_surveys.loc[i,'Last Download']
-        wilayah = json.loads(list_surveys.loc[i,'Wilayah'])
-        targets = json.loads(list_surveys.loc[i,'Target'])
-        target_column = list_surveys.loc[i,'Target Column']
-        try:
-            decoder = json.loads(list_surveys.loc[i,'Decoder'])
-        except:
-            decoder = None
-    
-        # download data
-        df = download_data(form_id, wilayah, decoder)
-        
-        # data preprocessing
-        conn = sqlite3.connect(DB_PATH)
-        metadata = pd.read_sql_query(f'SELECT * FROM {survey_name}_metadata', conn)
-        conn.close()
-        generate_datalake(survey_name, df, targets, target_column, metadata)
-        
-        # update last_download in list_surveys table
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        update_sql = '''
-            UPDATE list_surveys 
-            SET [Last Download] = ?
-            WHERE [Survey Name] = ?
-        '''
-        last_download = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute(update_sql, (last_download, survey_name))
-        conn.commit()
-        conn.close()
+    surveys = [get_parameters(list_surveys, i) for i in range(len(list_surveys))]
+
+    # download concurrently, build datalakes as soon as each download is finished
+    with ThreadPoolExecutor(max_workers=MAX_DOWNLOAD_WORKERS) as download_pool, ThreadPoolExecutor(max_workers=MAX_DATALAKE_WORKERS) as datalake_pool:
+        downloads = {download_pool.submit(download_survey, params, full_sync, run, timings): params['survey_name'] for params in surveys}
+        builds = {}
+        for future in as_completed(downloads):
+            try:
+                builds[datalake_pool.submit(build_survey, *future.result())] = downloads[future]
+            except Exception:
+                logger.exception(f'{downloads[future]}: download failed')
+        for future in as_completed(builds):
+            try:
+                future.result()
+            except Exception:
+                logger.exception(f'{builds[future]}: datalake build failed')
+    logger.info(f'{len(surveys)} surveys refreshed in {time.perf_counter() - start:.1f}s')
+    # stage timings of the run in one write (best effort)
+    try:
+        with get_writer(DB_PATH) as conn:
+            save_metrics(conn, timings)
+    except sqlite3.Error:
+        logger.exception('stage timings could not be saved')
+    # SurveyCTO requests
+    metrics = get_scto_client().pop_metrics()
+    logger.info(f"SurveyCTO: {metrics['requests']} requests ({metrics['errors']} errors), {metrics['bytes'] / 1e6:.1f} MB, total {metrics['seconds']:.1f}s, slowest {metrics['max_seconds']:.1f}s")
 
 
 # ------------------------------------------------------------------------------------
 
 # Run the scheduler continuously
+n_update = 0
 while True:
-    update()
+    update(full_sync=(n_update % FULL_SYNC_EVERY == 0))
+    n_update += 1
     time.sleep(3600)